@@ -0,0 +1,64 @@
+import random
+
+WORDS = ("giraffe", "browser", "layout", "socket", "the", "a", "of", "engineering", "token", "canvas")
+TAGS = ("b", "i", "big", "small", "p", "div", "li")
+
+
+def synthetic_html(size, seed=0):
+    rng = random.Random(seed)
+    parts = ["<!doctype html>\n<html>\n<body>\n"]
+    length = len(parts[0])
+    while length < size:
+        tag = rng.choice(TAGS)
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+        paragraph = f'<{tag} class="c{rng.randint(0, 9)}">{words} &lt;{rng.choice(WORDS)}&gt; &amp;</{tag}>\n'
+        parts.append(paragraph)
+        length += len(paragraph)
+    parts.append("</body>\n</html>\n")
+    return "".join(parts)
+
+
+def entity_heavy_html(size, seed=0):
+    rng = random.Random(seed)
+    entities = ("&amp;", "&lt;", "&gt;", "&quot;", "&nbsp;", "&eacute;", "&#8212;", "&#x2603;", "&hellip;")
+    parts, length = [], 0
+    while length < size:
+        words = " ".join(f"{rng.choice(WORDS)}{rng.choice(entities)}" for _ in range(rng.randint(5, 40)))
+        paragraph = f"<p>{words}</p>\n"
+        parts.append(paragraph)
+        length += len(paragraph)
+    return "".join(parts)
+
+
+def tag_heavy_html(size, seed=0):
+    rng = random.Random(seed)
+    parts, length = [], 0
+    while length < size:
+        tag = rng.choice(TAGS)
+        part = f'<{tag} id="n{rng.randint(0, 999)}" class="c{rng.randint(0, 9)}"><span>{rng.choice(WORDS)}</span></{tag}>'
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def cjk_html(size, seed=0):
+    # Unspaced Han text like xiyouji.html, so every paragraph is one long word for the layout.
+    rng = random.Random(seed)
+    parts, length = ["<!doctype html>\n<body>\n"], 0
+    while length < size:
+        sentence = "".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(rng.randint(8, 30))) + "。"
+        paragraph = f"<p>{sentence * rng.randint(1, 4)}</p>\n"
+        parts.append(paragraph)
+        length += len(paragraph.encode("utf-8"))
+    parts.append("</body>\n")
+    return "".join(parts)
+
+
+CORPORA = {
+    "small": lambda: synthetic_html(10_000),
+    "1mb": lambda: synthetic_html(1_000_000),
+    "10mb": lambda: synthetic_html(10_000_000),
+    "entities": lambda: entity_heavy_html(1_000_000),
+    "tags": lambda: tag_heavy_html(1_000_000),
+    "cjk": lambda: cjk_html(1_000_000),
+}
@@ -0,0 +1,34 @@
+import io
+import logging
+import sys
+import time
+from io import BytesIO
+
+from giraffe.url import URL, logger
+
+HEADERS = "".join(f"X-Header-{i}: {'v' * 40}\r\n" for i in range(20))
+RESPONSE = f"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n{HEADERS}\r\nhello".encode()
+
+
+def per_request_us(requests):
+    url = URL("http://example.org/")
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = BytesIO(RESPONSE)
+        url._redirect(response)
+        url._parse_body(response)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    handler = logging.StreamHandler(io.StringIO())
+    logger.addHandler(handler)
+    logger.propagate = False
+    for name, level in (("debug off", logging.WARNING), ("debug on", logging.DEBUG)):
+        logger.setLevel(level)
+        print(f"{name:>9}: {per_request_us(requests):7.2f} us per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import time
+
+from benchmarks.corpus import synthetic_html
+from giraffe.browser import HeadlessBrowser, Layout
+from giraffe.url import FastHtmlLexer
+
+SIZES = (10_000, 100_000, 1_000_000)
+FRAMES = 50
+
+
+def frame_ms(browser):
+    start = time.perf_counter()
+    for frame in range(FRAMES):
+        browser.scroll = frame * browser.display_list.ys[-1] / FRAMES
+        browser.draw()
+    return (time.perf_counter() - start) * 1000 / FRAMES
+
+
+def main():
+    for size in SIZES:
+        browser = HeadlessBrowser()
+        browser.display_list = Layout(FastHtmlLexer(synthetic_html(size)).lex(), browser.fonts)
+        print(f"{size:>9} bytes, {len(browser.display_list):>6} words: {frame_ms(browser):6.3f} ms per frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import json
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import synthetic_html
+
+SIZES_MB = (1, 10, 100)
+METHODS = ("readlines", "mmap")
+# "keep" holds on to every token, as URL.load, HeadlessBrowser.load and Browser._receive do; "count" drops
+# each one once seen. Streaming from mmap only saves memory for consumers that don't keep the tokens.
+CONSUMERS = ("keep", "count")
+
+
+def run(method, consumer, path):
+    from giraffe.url import URL, FastHtmlLexer
+
+    start = time.perf_counter()
+    if method == "readlines":
+        with open(path, encoding="utf8", newline="\r\n") as f:
+            body = "".join(f.readlines())
+        tokens = _lex_in_slices(FastHtmlLexer(), body)
+    else:
+        url = URL(pathlib.Path(path).as_uri())
+        url.lexer = FastHtmlLexer
+        tokens = url.stream()
+    # Both methods hand over a token iterator, so they only differ in how the page is read.
+    count = len(list(tokens)) if consumer == "keep" else sum(1 for _ in tokens)
+    seconds = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"tokens": count, "seconds": seconds, "peak_kb": peak_kb}))
+
+
+def _lex_in_slices(lexer, body):
+    from giraffe.url import CHUNK_SIZE
+
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield from lexer._consume(body[start:start + CHUNK_SIZE])
+    yield from lexer._finish()
+
+
+def measure(method, consumer, path):
+    # A fresh interpreter per run so peak RSS isn't inherited from earlier runs.
+    code = f"from benchmarks.file_load import run; run({method!r}, {consumer!r}, {str(path)!r})"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES_MB
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = pathlib.Path(directory) / f"{size}mb.html"
+            path.write_text(synthetic_html(size * 1_000_000), encoding="utf8")
+            for consumer in CONSUMERS:
+                for method in METHODS:
+                    result = measure(method, consumer, path)
+                    print(f"{size:>4} MB {method:>9} {consumer:>5}: {result['seconds']:7.2f} s, "
+                          f"peak RSS {result['peak_kb'] / 1024:8.1f} MB, {result['tokens']} tokens")
+
+
+if __name__ == "__main__":
+    main()
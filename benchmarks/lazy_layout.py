@@ -0,0 +1,25 @@
+import sys
+import time
+
+from benchmarks.corpus import synthetic_html
+from giraffe.browser import HEIGHT, Layout, LazyLayout
+from giraffe.url import FastHtmlLexer
+
+SIZES = (10_000, 1_000_000, 10_000_000)
+
+
+def open_ms(layout, tokens):
+    start = time.perf_counter()
+    layout(tokens).ensure(HEIGHT)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    for size in sizes:
+        tokens = FastHtmlLexer(synthetic_html(size)).lex()
+        print(f"{size:>9} bytes: eager {open_ms(Layout, tokens):9.2f} ms, lazy {open_ms(LazyLayout, tokens):6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
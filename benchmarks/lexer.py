@@ -0,0 +1,27 @@
+import sys
+import time
+
+from benchmarks.corpus import synthetic_html
+from giraffe.url import HtmlLexer, FastHtmlLexer, PackedHtmlLexer
+
+LEXERS = (HtmlLexer, FastHtmlLexer, PackedHtmlLexer)
+
+
+def throughput(lexer, body, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        lexer(body).lex()
+        best = min(best, time.perf_counter() - start)
+    return len(body.encode("utf-8")) / best / 1e6
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    body = synthetic_html(size)
+    for lexer in LEXERS:
+        print(f"{lexer.__name__:>15}: {throughput(lexer, body):8.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import sys
+import tracemalloc
+
+from benchmarks.corpus import synthetic_html
+from giraffe.browser import FakeFont, Layout
+from giraffe.url import FastHtmlLexer, PackedHtmlLexer
+
+
+def tuple_entries(layout):
+    # The old representation: a list of ((x, y), word, font) with a fresh font object per word.
+    return [((x, y), word, FakeFont(font.weight, font.slant, font.size)) for (x, y), word, font in layout]
+
+
+def columnar_bytes(layout):
+    columns = (layout.xs, layout.ys, layout.font_ids, layout.words,
+               layout.item_words, layout.item_font_ids, layout.item_widths)
+    return sum(sys.getsizeof(column) for column in columns)
+
+
+def traced(build):
+    tracemalloc.start()
+    result = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, allocated
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    body = synthetic_html(size)
+    token_list, list_bytes = traced(lambda: FastHtmlLexer(body).lex())
+    packed, packed_bytes = traced(lambda: PackedHtmlLexer(body).lex())
+    tokens = len(token_list)
+    layout = Layout(packed)
+    words = len(layout)
+
+    tracemalloc.start()
+    entries = tuple_entries(layout)
+    tuple_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del entries
+
+    print(f"{tokens} tokens")
+    print(f"  token objects:  {list_bytes / tokens:6.1f} bytes per token")
+    print(f"  packed tokens:  {packed_bytes / tokens:6.1f} bytes per token")
+    print(f"{words} words")
+    print(f"  list of tuples: {tuple_bytes / words:6.1f} bytes per word")
+    print(f"  columnar:       {columnar_bytes(layout) / words:6.1f} bytes per word (display list and reflow items)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import sys
+import time
+
+from benchmarks.corpus import synthetic_html
+from giraffe.browser import FakeFont, FontCache, Layout
+from giraffe.url import FastHtmlLexer
+
+WIDTHS = range(400, 1200, 50)
+
+
+def per_resize_ms(resize):
+    start = time.perf_counter()
+    for width in WIDTHS:
+        resize(width)
+    return (time.perf_counter() - start) * 1000 / len(WIDTHS)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    tokens = FastHtmlLexer(synthetic_html(size)).lex()
+    fonts = FontCache(FakeFont)
+    layout = Layout(tokens, fonts)
+    print(f"{len(layout)} words")
+    print(f"  rebuild Layout: {per_resize_ms(lambda width: Layout(tokens, fonts, width)):8.1f} ms per resize")
+    print(f"  reflow:         {per_resize_ms(layout.reflow):8.1f} ms per resize")
+
+
+if __name__ == "__main__":
+    main()
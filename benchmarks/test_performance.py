@@ -0,0 +1,63 @@
+import functools
+
+import pytest
+
+from benchmarks.corpus import CORPORA
+from conftest import Route
+from giraffe.browser import HeadlessBrowser, Layout
+from giraffe.url import URL, HtmlLexer, FastHtmlLexer
+
+pytest.importorskip("pytest_benchmark")
+
+SMALL_CORPORA = [name for name in CORPORA if name != "10mb"]
+
+
+@functools.cache
+def corpus(name):
+    return CORPORA[name]()
+
+
+@functools.cache
+def tokens(name):
+    return FastHtmlLexer(corpus(name)).lex()
+
+
+@pytest.mark.parametrize("name", SMALL_CORPORA)
+def test_html_lexer(benchmark, name):
+    benchmark(lambda: HtmlLexer(corpus(name)).lex())
+
+
+@pytest.mark.parametrize("name", CORPORA)
+def test_fast_html_lexer(benchmark, name):
+    benchmark(lambda: FastHtmlLexer(corpus(name)).lex())
+
+
+@pytest.mark.parametrize("name", CORPORA)
+def test_layout(benchmark, name):
+    benchmark(Layout, tokens(name))
+
+
+@pytest.mark.parametrize("name", SMALL_CORPORA)
+def test_draw(benchmark, name):
+    browser = HeadlessBrowser()
+    browser.display_list = Layout(tokens(name), browser.fonts)
+    browser.scroll = browser.display_list.ys[-1] / 2
+    benchmark(browser.draw)
+
+
+@pytest.mark.parametrize("name", SMALL_CORPORA)
+def test_scroll(benchmark, name):
+    browser = HeadlessBrowser()
+    browser.display_list = Layout(tokens(name), browser.fonts)
+
+    def scroll():
+        browser.scroll_down(None)
+        browser.scroll_up(None)
+    benchmark(scroll)
+
+
+@pytest.mark.parametrize("name", ("small", "1mb", "cjk"))
+def test_load(benchmark, http_server, name):
+    body = corpus(name).encode("utf-8")
+    http_server.routes["/page"] = Route(body)
+    benchmark(URL(http_server.url("/page")).load)
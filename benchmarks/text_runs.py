@@ -0,0 +1,40 @@
+import time
+
+from benchmarks.corpus import cjk_html, synthetic_html
+from giraffe.browser import Layout
+from giraffe.url import FastHtmlLexer, Text
+
+PROSE = [Text(" ".join(["giraffe", "a", "browser", "of", "engineering"] * 400)) for _ in range(50)]
+
+
+def word_by_word(tokens):
+    layout = Layout()
+    for token in tokens:
+        if isinstance(token, Text):
+            for word in token.text.split():
+                layout.word(word)
+    return layout
+
+
+def best_us_per_word(build, tokens, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        layout = build(tokens)
+        best = min(best, time.perf_counter() - start)
+    return best / len(layout) * 1e6
+
+
+def main():
+    corpora = {
+        "prose": PROSE,
+        "synthetic": FastHtmlLexer(synthetic_html(1_000_000)).lex(),
+        "cjk": FastHtmlLexer(cjk_html(1_000_000)).lex(),
+    }
+    for name, tokens in corpora.items():
+        print(f"{name:>9}: word by word {best_us_per_word(word_by_word, tokens):5.2f} us/word, "
+              f"runs {best_us_per_word(Layout, tokens):5.2f} us/word")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 
 import giraffe
-from giraffe.url import URL
+from giraffe import metrics
+from giraffe.url import URL, ConnectionPool, HttpCache
 
 SCROLL_AMOUNT = 10
 ORIGIN = (13, 18)
 
 
+def pytest_addoption(parser):
+    parser.addoption("--benchmarks", action="store_true", help="run the performance suite in benchmarks/")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="pass --benchmarks to run the performance suite")
+    for item in items:
+        if "benchmark" in item.fixturenames:
+            item.add_marker(skip)
+
+
 @pytest.fixture
 def sample_url():
     return URL("data:text/html,A B <b>bold</b>")
@@ -17,3 +40,135 @@ def browser(sample_url):
     browser = giraffe.browser.HeadlessBrowser()
     browser.load(sample_url)
     return browser
+
+
+@dataclass
+class Route:
+    body: bytes = b""
+    status: int = 200
+    headers: dict = field(default_factory=dict)
+    chunked: bool = False
+    delay: float = 0
+
+
+class _RouteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers))
+        route = self.server.routes.get(self.path, Route(b"not found", status=404))
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        time.sleep(route.delay)
+        with self.server.lock:
+            self.server.in_flight -= 1
+        if self._not_modified(route):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(route.status)
+        for header, value in route.headers.items():
+            self.send_header(header, value)
+        if route.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(route.body), 7):
+                piece = route.body[start:start + 7]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(route.body)))
+            self.end_headers()
+            self.wfile.write(route.body)
+
+    def _not_modified(self, route):
+        etag, last_modified = route.headers.get("ETag"), route.headers.get("Last-Modified")
+        if etag and self.headers["If-None-Match"] == etag:
+            return True
+        return last_modified and self.headers["If-Modified-Since"] == last_modified
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, ssl_context=None):
+        super().__init__(("127.0.0.1", 0), _RouteHandler)
+        self.routes = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.scheme = "http"
+        if ssl_context:
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True)
+            self.scheme = "https"
+
+    def url(self, path):
+        host, port = self.server_address
+        return f"{self.scheme}://{host}:{port}{path}"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = ConnectionPool()
+    monkeypatch.setattr(giraffe.url, "connection_pool", pool)
+    yield pool
+    pool.close()
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = HttpCache()
+    monkeypatch.setattr(giraffe.url, "http_cache", cache)
+    monkeypatch.setattr(giraffe.url, "_permanent_redirects", OrderedDict())
+    return cache
+
+
+@pytest.fixture
+def recorded_metrics(monkeypatch):
+    sink = metrics.HistogramSink()
+    monkeypatch.setattr(metrics, "sink", sink)
+    return sink
+
+
+@pytest.fixture
+def http_server(pool, cache):
+    yield from _serve(LocalServer())
+
+
+@pytest.fixture(scope="session")
+def tls_certificate(tmp_path_factory):
+    if not shutil.which("openssl"):
+        pytest.skip("openssl is needed to create a self-signed certificate")
+    directory = tmp_path_factory.mktemp("tls")
+    certificate, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+         "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", key, "-out", certificate],
+        check=True, capture_output=True,
+    )
+    return certificate, key
+
+
+@pytest.fixture
+def https_server(pool, cache, tls_certificate, monkeypatch):
+    certificate, key = tls_certificate
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(certificate, key)
+    monkeypatch.setattr(giraffe.url, "_ssl_context", ssl.create_default_context(cafile=certificate))
+    monkeypatch.setattr(giraffe.url, "_tls_sessions", {})
+    monkeypatch.setattr(giraffe.url, "tls_handshakes", deque(maxlen=giraffe.url.MAX_HANDSHAKES))
+    yield from _serve(LocalServer(server_context))
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from giraffe.browser import FakeFont, Layout
+from giraffe.layout_cache import LAYOUT_CACHE_DIRECTORY, LayoutCache
+from giraffe.url import URL, PackedHtmlLexer, Scheme
+
+CHUNK_SIZE = 8  # pages per task
+TASKS_PER_WORKER = 4  # tasks kept in flight per worker, so huge URL lists aren't submitted up front
+
+_layout_cache = None  # per worker process
+
+
+def render_batch(urls, order="input", workers=None, chunk_size=CHUNK_SIZE, layout_cache=None):
+    workers = workers or os.cpu_count()
+    tasks = _chunks(enumerate(urls), chunk_size)
+    max_tasks, max_finished = workers * TASKS_PER_WORKER, workers * TASKS_PER_WORKER * chunk_size
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(layout_cache,)) as executor:
+        pending, finished, next_index = set(), {}, 0
+        while True:
+            # Pages held back for input order count against the bound too, or one stalled page
+            # would leave every later page buffered here.
+            while len(pending) < max_tasks and len(finished) < max_finished:
+                chunk = next(tasks, None)
+                if chunk is None:
+                    break
+                pending.add(executor.submit(_render_chunk, chunk))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for index, lines in future.result():
+                    if order == "completion":
+                        yield lines
+                    else:
+                        finished[index] = lines
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+
+
+def render_page(url, layout_cache=None):
+    try:
+        tokens = URL(url).load()
+        layout = layout_cache.layout(tokens, FakeFont) if layout_cache else Layout(tokens)
+    except Exception as e:
+        return json.dumps({"url": url, "error": f"{type(e).__name__}: {e}"}) + "\n"
+    # One json.dumps per word is most of the cost of a page, so only the word is encoded per line.
+    prefix = json.dumps({"url": url})[:-1] + ', "word": '
+    suffixes = [
+        f', "weight": {json.dumps(font.weight)}, "slant": {json.dumps(font.slant)}, "size": {json.dumps(font.size)}}}\n'
+        for font in layout.font_table
+    ]
+    return "".join(
+        f'{prefix}{json.dumps(word)}, "x": {x!r}, "y": {y!r}{suffixes[font_id]}'
+        for x, y, word, font_id in zip(layout.xs, layout.ys, layout.words, layout.font_ids)
+    )
+
+
+def _render_chunk(chunk):
+    return [(index, render_page(url, _layout_cache)) for index, url in chunk]
+
+
+def _init_worker(layout_cache_directory):
+    global _layout_cache
+    URL.html_lexer = PackedHtmlLexer
+    if layout_cache_directory:
+        _layout_cache = LayoutCache(layout_cache_directory)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _as_url(location):
+    if location.split(":", 1)[0] in (*Scheme, "view-source"):
+        return location
+    return pathlib.Path(location).resolve().as_uri()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lay out many pages with FakeFont metrics and print JSON lines.")
+    parser.add_argument("urls", nargs="*", help="URLs or file paths")
+    parser.add_argument("-i", "--input", type=argparse.FileType("r"), help="read URLs or file paths from FILE, one per line")
+    parser.add_argument("-o", "--output", type=argparse.FileType("w", encoding="utf-8"), default=sys.stdout)
+    parser.add_argument("--order", choices=("input", "completion"), default="input")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="pages per task sent to a worker")
+    parser.add_argument("--layout-cache", metavar="DIR", nargs="?", const=LAYOUT_CACHE_DIRECTORY,
+                        help="reuse layouts of pages whose tokens haven't changed (default %(const)s)")
+    args = parser.parse_args()
+
+    locations = list(args.urls)
+    if args.input:
+        locations.extend(line.strip() for line in args.input if line.strip())
+    urls = [_as_url(location) for location in locations]
+
+    start = time.perf_counter()
+    pages = 0
+    for lines in render_batch(urls, args.order, args.workers, args.chunk_size, args.layout_cache):
+        args.output.write(lines)
+        pages += 1
+    seconds = time.perf_counter() - start
+    print(f"Rendered {pages} pages in {seconds:.2f} s ({pages / seconds:.1f} pages/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
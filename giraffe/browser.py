@@ -1,23 +1,37 @@
+import bisect
 import logging
 import time
 import tkinter
 import tkinter.font
+from array import array
+from collections import OrderedDict
 from dataclasses import dataclass
+from itertools import accumulate, chain, islice, repeat
+from operator import add
 from tkinter import BOTH
 from typing import override
 
-from giraffe.url import URL, Text
+from giraffe import metrics
+from giraffe.loader import PageLoad
+from giraffe.url import URL, Text, use_disk_cache
 
 NORMAL = "normal"
 ROMAN = "roman"
 
 WIDTH, HEIGHT = 800, 600
 HMARGIN, VMARGIN = 13, 18
+FONT_CACHE_WORDS = 10_000
+RETAINED_MARGIN = HEIGHT
+LAYOUT_LOOKAHEAD = HEIGHT
+WIDTH_PROBES = ("iW", "\u4e2d\u6587", "\uac00", "\u3042")
+SHORT_RUN = 4  # words
+LAZY_LAYOUT_TOKENS = 256  # tokens laid out per step while catching up with the viewport
 
 
 def main():
     logging.basicConfig(level=logging.INFO)
     import sys
+    use_disk_cache()
     browser = Browser()
     if len(sys.argv) > 1:
         url = URL(sys.argv[1])
@@ -31,6 +45,7 @@ def main():
 @dataclass
 class FakeFont:
     HSTEP, VSTEP = 17, 23
+    uniform_width = True  # words measure len(word) * HSTEP; no Tk font promises that
     weight: str = NORMAL
     slant: str = ROMAN
     size: int = 12
@@ -40,6 +55,8 @@ class FakeFont:
         match name:
             case "linespace":
                 return FakeFont.VSTEP
+            case "fixed":
+                return 1
             case _:
                 raise ValueError()
 
@@ -48,32 +65,125 @@ class FakeFont:
         return FakeFont.HSTEP * len(word)
 
 
+class FontCache:
+    def __init__(self, fonts, max_words=FONT_CACHE_WORDS):
+        self.fonts = fonts
+        self.max_words = max_words
+        self.hits = 0
+        self.misses = 0
+        self._fonts = {}
+        self._linespaces = {}
+        self._char_widths = {}  # font key -> width of every character, or None if they differ
+        self._widths = {}  # font key -> OrderedDict of word widths, least recently used first
+
+    def font(self, key):
+        font = self._fonts.get(key)
+        if font is None:
+            weight, slant, size = key
+            font = self._fonts[key] = self.fonts(weight=weight, slant=slant, size=size)
+            self._linespaces[key] = font.metrics("linespace")
+            self._char_widths[key] = _uniform_char_width(font)
+            self._widths[key] = OrderedDict()
+        return font
+
+    def linespace(self, key):
+        if key not in self._linespaces:
+            self.font(key)
+        return self._linespaces[key]
+
+    def measure_words(self, key, words):
+        if key not in self._char_widths:
+            self.font(key)
+        char_width = self._char_widths[key]
+        if char_width is not None:
+            return [char_width * len(word) for word in words]
+        measure = self.measure
+        return [float(measure(key, word)) for word in words]
+
+    def measure(self, key, word):
+        widths = self._widths.get(key)
+        if widths is None:
+            self.font(key)
+            widths = self._widths[key]
+        width = widths.get(word)
+        if width is None:
+            self.misses += 1
+            width = widths[word] = self._fonts[key].measure(word)
+            if len(widths) > self.max_words:
+                widths.popitem(last=False)
+        else:
+            self.hits += 1
+            widths.move_to_end(word)
+        return width
+
+
+def _uniform_char_width(font):
+    # Even a fixed-width Tk font draws combining marks, emoji and fallback glyphs at other widths, so only
+    # fonts declaring uniform_width get the shortcut. They must still pass the probe, as a subclass may not.
+    if not getattr(font, "uniform_width", False) or not font.metrics("fixed"):
+        return None
+    width = font.measure("0")
+    if all(font.measure(probe) == len(probe) * width for probe in WIDTH_PROBES):
+        return float(width)
+    return None
+
+
 class HeadlessBrowser:
+    lazy_layout = False
+    layout_cache = None  # a giraffe.layout_cache.LayoutCache, to reuse layouts across loads and widths
+
     def __init__(self):
         self.height = HEIGHT
-        self.display_list = []
         self.scroll = 0
-        self.fonts = FakeFont
+        self.digest = None
+        self.fonts = FontCache(FakeFont)
+        self.display_list = Layout([], self.fonts)
 
     def load(self, url):
-        self.text = url.load()
-        self.display_list = Layout(self.text, self.fonts)
+        if self.lazy_layout:
+            # Lex the whole page so the connection is released, but only lay out what's on screen.
+            self.text = url.load()
+            self.display_list = LazyLayout(self.text, self.fonts)
+            self.display_list.ensure(self.scroll + self.height)
+            self.draw()
+            return
+        if self.layout_cache:
+            # The cache is keyed by a hash of the tokens, so they all have to arrive before layout.
+            self.text = url.load()
+            self.digest = self.layout_cache.digest(self.text)
+            with metrics.span("layout"):
+                self.display_list = self.layout_cache.layout(self.text, self.fonts, WIDTH, self.digest)
+            self.draw()
+            return
+        self.text = []
+        with metrics.span("layout"):
+            self.display_list = Layout(self._record(url.stream()), self.fonts)
         self.draw()
 
+    def _record(self, tokens):
+        for token in tokens:
+            self.text.append(token)
+            yield token
+
     def draw(self):
-        words = 0
         frame_start = time.perf_counter()
-        for (x, y), word, font in self.display_list:
-            if not self._is_offscreen(y):
-                logging.debug(f"Drawing [{word}] at {x},{y}")
-                self.create_text(x, y - self.scroll, word, font)
-                words += 1
+        with metrics.span("draw"):
+            words = self._paint()
         frame_end = time.perf_counter()
         frame_ms = (frame_end - frame_start) * 1000
-        logging.info(f"Drew {words} words in {frame_ms:.1f} ms")
+        logging.info("Drew %d words in %.1f ms", words, frame_ms)
+
+    def _paint(self):
+        start, end = self.display_list.visible_range(self.scroll, self.height)
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        for (x, y), word, font in self.display_list[start:end]:
+            if debug:
+                logging.debug("Drawing [%s] at %s,%s", word, x, y)
+            self.create_text(x, y - self.scroll, word, font)
+        return end - start
 
     def create_text(self, x, y, word, font):
-        logging.debug(f"Pretending to draw [{word}] in {font} at {x},{y}")
+        logging.debug("Pretending to draw [%s] in %s at %s,%s", word, font, x, y)
 
     def _should_draw(self, y):
         return not self._is_offscreen(y)
@@ -93,99 +203,389 @@ class HeadlessBrowser:
     def _scroll(self, amount):
         self.scroll += amount
         self.scroll = max(0, self.scroll)
+        self.display_list.ensure(self.scroll + self.height)
         self.draw()
 
     def resize(self, event):
         self.height = event.height
-        self.display_list = Layout(self.text, self.fonts, event.width)
+        if event.width != self.display_list.width:
+            with metrics.span("layout"):
+                self._relayout(event.width)
+        self.display_list.ensure(self.scroll + self.height)
         self.draw()
 
+    def _relayout(self, width):
+        cached = self.layout_cache and self.digest and self.layout_cache.lookup(self.digest, self.fonts, width)
+        if cached:
+            self.display_list = cached
+            return
+        self.display_list.reflow(width)
+        if self.layout_cache and self.digest:
+            self.layout_cache.store(self.digest, self.display_list)
+
 
 class Browser(HeadlessBrowser):
     def __init__(self):
         super().__init__()
         self.window = tkinter.Tk()
-        self.fonts = tkinter.font.Font
+        self.fonts = FontCache(tkinter.font.Font)
         self.canvas = tkinter.Canvas(self.window, width=WIDTH, height=self.height)
         self.window.bind("<Down>", self.scroll_down)
         self.window.bind("<Up>", self.scroll_up)
         self.window.bind("<MouseWheel>", self.scroll_wheel)
         self.window.bind("<Configure>", self.resize)
         self.canvas.pack(fill=BOTH, expand=1)
+        self._pending_resize = None
+        self.painter = RetainedCanvas(self.canvas, self.create_text)
+        self.page_load = None
+        self._font_cache_counts = (0, 0)
 
     @override
-    def draw(self):
-        self.canvas.delete("all")
-        super().draw()
+    def load(self, url):
+        # Fetching and lexing happen on a worker thread; layout stays here because Tk fonts are only
+        # safe to measure from the Tk thread.
+        if self.page_load:
+            self.page_load.cancel()
+        self.text = []
+        self.scroll = 0
+        self.display_list = Layout([], self.fonts)
+        self._font_cache_counts = (self.fonts.hits, self.fonts.misses)  # Layout([]) has nothing to log yet
+        self.page_load = PageLoad(url, self.window.after, self._receive, self._loaded)
+        self.page_load.start()
+
+    def _receive(self, tokens):
+        painted = len(self.display_list)
+        self.text.extend(tokens)
+        with metrics.span("layout"):
+            self.display_list.feed(tokens)
+        if not painted and len(self.display_list):
+            first_paint = time.perf_counter() - self.page_load.started
+            logging.info("First paint %.1f ms after navigation", first_paint * 1000)
+            metrics.sink.record("first_paint", first_paint)
+        if painted < len(self.display_list) and self.display_list.ys[painted] < self.scroll + self.height:
+            self.draw()
+
+    def _loaded(self, error):
+        if error:
+            logging.error("Couldn't load %s: %s", self.page_load.url, error)
+        self.display_list._log_font_cache(*self._font_cache_counts)
+        self.page_load = None
+
+    @override
+    def resize(self, event):
+        # Dragging the window edge floods us with <Configure>; only lay out the last size once idle.
+        if self._pending_resize is None:
+            self.window.after_idle(self._apply_resize)
+        self._pending_resize = event
+
+    def _apply_resize(self):
+        event, self._pending_resize = self._pending_resize, None
+        super().resize(event)
+
+    @override
+    def _paint(self):
+        return self.painter.draw(self.display_list, self.scroll, self.height)
 
     @override
     def create_text(self, x, y, word, font):
         escaped = word.replace('"', '\\"')
-        self.canvas.create_text(x, y, text=word, font=font, anchor='nw', tag=f'"{escaped}"')
-
+        return self.canvas.create_text(x, y, text=word, font=font, anchor='nw', tag=f'"{escaped}"')
+
+
+class RetainedCanvas:
+    def __init__(self, canvas, create_text, margin=RETAINED_MARGIN):
+        self.canvas = canvas
+        self.create_text = create_text
+        self.margin = margin
+        self.items = {}  # display list index -> canvas item id
+        self.band = (0, 0)
+        self.layout = None
+        self.generation = None
+        self.scroll = 0
 
-class Layout(list):
-    def __init__(self, tokens, fonts=FakeFont, width=WIDTH):
+    def draw(self, layout, scroll, height):
+        if layout is not self.layout or layout.generation != self.generation:
+            self.canvas.delete("all")
+            self.items = {}
+            self.band = (0, 0)
+            self.layout, self.generation, self.scroll = layout, layout.generation, scroll
+        if scroll != self.scroll:
+            self.canvas.move("all", 0, self.scroll - scroll)
+            self.scroll = scroll
+        start, end = layout.visible_range(scroll - self.margin, height + 2 * self.margin)
+        old_start, old_end = self.band
+        for index in chain(range(old_start, min(old_end, start)), range(max(old_start, end), old_end)):
+            self.canvas.delete(self.items.pop(index))
+        created = 0
+        for index in chain(range(start, min(end, old_start)), range(max(start, old_end), end)):
+            (x, y), word, font = layout[index]
+            self.items[index] = self.create_text(x, y - scroll, word, font)
+            created += 1
+        self.band = (start, end)
+        return created
+
+
+class DisplayList:
+    def __init__(self):
+        # Doubles rather than floats: float32 stops being exact for y past a few million pixels.
+        self.xs = array("d")
+        self.ys = array("d")  # nondecreasing, so it can be bisected
+        self.font_ids = array("I")
+        self.words = []
+        self.font_table = []
+        self._font_ids = {}  # font key -> index into font_table
+
+    def intern_font(self, key, font):
+        font_id = self._font_ids.get(key)
+        if font_id is None:
+            font_id = self._font_ids[key] = len(self.font_table)
+            self.font_table.append(font)
+        return font_id
+
+    def append(self, x, y, word, font_id):
+        self.xs.append(x)
+        self.ys.append(y)
+        self.words.append(word)
+        self.font_ids.append(font_id)
+
+    def clear(self):
+        del self.xs[:], self.ys[:], self.font_ids[:], self.words[:]
+
+    def visible_range(self, scroll, height):
+        return bisect.bisect_left(self.ys, scroll - VMARGIN), bisect.bisect_right(self.ys, scroll + height)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return (self.xs[index], self.ys[index]), self.words[index], self.font_table[self.font_ids[index]]
+
+    def __iter__(self):
+        font_table = self.font_table
+        for x, y, word, font_id in zip(self.xs, self.ys, self.words, self.font_ids):
+            yield (x, y), word, font_table[font_id]
+
+
+class Layout(DisplayList):
+    def __init__(self, tokens=(), fonts=FakeFont, width=WIDTH):
+        super().__init__()
         self.cursor_x, self.cursor_y = HMARGIN, VMARGIN
-        self.fonts = fonts
+        # Measured words, kept so reflow() never measures again; a None word is a paragraph break.
+        self.item_words = []
+        self.item_font_ids = array("I")
+        self.item_widths = array("d")
+        self.spaces = array("d")  # per font id
+        self.linespaces = array("d")  # per font id
+        self.generation = 0
+        self.fonts = fonts if isinstance(fonts, FontCache) else FontCache(fonts)
         self.width = width
         self.weight = NORMAL
         self.style = ROMAN
         self.size = 12
         self.in_script = False
         self.in_style = False
+        hits, misses = self.fonts.hits, self.fonts.misses
+        self.feed(tokens)
+        self._log_font_cache(hits, misses)
+
+    def feed(self, tokens):
+        handlers = self.TAG_HANDLERS
         for token in tokens:
             if isinstance(token, Text):
                 if not self.in_script and not self.in_style:
                     self._layout_text(token.text)
-            else:
-                self._handle_tag(token.tag)
-
-    def _handle_tag(self, tag):
-        tag = tag.split()[0]  # discard attributes
-        if "/script" in tag:
-            self.in_script = False
-        elif tag.startswith("script"):
-            self.in_script = True
-        elif "/style" in tag:
-            self.in_style = False
-        elif tag.startswith("style"):
-            self.in_style = True
-        elif tag in ("br", "/p", "/li", "/div"):
-            if self.cursor_x != HMARGIN:
-                self.cursor_x = HMARGIN
-                self.cursor_y += 1.5 * self._font().metrics("linespace")
-        elif tag == "b":
-            self.weight = "bold"
-        elif tag == "/b":
-            self.weight = NORMAL
-        elif tag == "i":
-            self.style = "italic"
-        elif tag == "/i":
-            self.style = ROMAN
-        elif tag == "big":
-            self.size += 4
-        elif tag == "/big":
-            self.size -= 4
-        elif tag == "small":
-            self.size -= 2
-        elif tag == "/small":
-            self.size += 2
+            elif (handler := handlers.get(token.name)) is not None:
+                handler(self)
+
+    @property
+    def estimated_height(self):
+        return self.cursor_y
+
+    def ensure(self, y):
+        pass  # everything is already laid out
+
+    def _open_script(self):
+        self.in_script = True
+
+    def _close_script(self):
+        self.in_script = False
+
+    def _open_style(self):
+        self.in_style = True
+
+    def _close_style(self):
+        self.in_style = False
+
+    def _break(self):
+        self._add_item(None, self._font_id(), 0)
+
+    def _open_bold(self):
+        self.weight = "bold"
+
+    def _close_bold(self):
+        self.weight = NORMAL
+
+    def _open_italic(self):
+        self.style = "italic"
+
+    def _close_italic(self):
+        self.style = ROMAN
+
+    def _open_big(self):
+        self.size += 4
+
+    def _close_big(self):
+        self.size -= 4
+
+    def _open_small(self):
+        self.size -= 2
+
+    def _close_small(self):
+        self.size += 2
+
+    TAG_HANDLERS = {
+        "script": _open_script, "/script": _close_script,
+        "style": _open_style, "/style": _close_style,
+        "br": _break, "/p": _break, "/li": _break, "/div": _break,
+        "b": _open_bold, "/b": _close_bold,
+        "i": _open_italic, "/i": _close_italic,
+        "big": _open_big, "/big": _close_big,
+        "small": _open_small, "/small": _close_small,
+    }
 
     def _layout_text(self, text):
-        for word in text.split():
-            self.word(word)
+        words = text.split()
+        if not words:
+            return
+        key = self._font_key()
+        font_id = self._font_ids.get(key)
+        if font_id is None:
+            font_id = self._font_id()
+        if len(words) == 1:
+            self._add_item(words[0], font_id, self.fonts.measure(key, words[0]))
+            return
+        start = len(self.item_words)
+        self.item_words.extend(words)
+        self.item_font_ids.extend(array("I", [font_id]) * len(words))
+        widths = self.fonts.measure_words(key, words)
+        self.item_widths.fromlist(widths)
+        if len(words) < SHORT_RUN:
+            self._place(start, len(self.item_words))  # prefix sums don't pay for themselves here
+        else:
+            self._place_run(words, widths, font_id)
 
     def word(self, word):
-        w = self._font().measure(word)
-        if self.cursor_x + w > self.width - HMARGIN:
-            self.cursor_y += 1.25 * self._font().metrics("linespace")
-            self.cursor_x = HMARGIN
-        self.append(((self.cursor_x, self.cursor_y), word, self._font()))
-        self.cursor_x += w + self._font().measure(" ")
-
-    def _font(self):
-        return self.fonts(weight=self.weight, slant=self.style, size=self.size)
+        self._add_item(word, self._font_id(), self.fonts.measure(self._font_key(), word))
+
+    def reflow(self, width):
+        self.width = width
+        self.generation += 1
+        self.clear()
+        self.cursor_x, self.cursor_y = HMARGIN, VMARGIN
+        self._place(0, len(self.item_words))
+
+    def _add_item(self, word, font_id, w):
+        self.item_words.append(word)
+        self.item_font_ids.append(font_id)
+        self.item_widths.append(w)
+        self._place(len(self.item_words) - 1, len(self.item_words))
+
+    def _place(self, start, end):
+        x, y, right = self.cursor_x, self.cursor_y, self.width - HMARGIN
+        words, font_ids, widths = self.item_words, self.item_font_ids, self.item_widths
+        spaces, linespaces = self.spaces, self.linespaces
+        xs, ys, placed_words, placed_font_ids = self.xs, self.ys, self.words, self.font_ids
+        for i in range(start, end):
+            word, font_id = words[i], font_ids[i]
+            if word is None:
+                if x != HMARGIN:
+                    x = HMARGIN
+                    y += 1.5 * linespaces[font_id]
+                continue
+            w = widths[i]
+            if x + w > right:
+                y += 1.25 * linespaces[font_id]
+                x = HMARGIN
+            xs.append(x)
+            ys.append(y)
+            placed_words.append(word)
+            placed_font_ids.append(font_id)
+            x += w + spaces[font_id]
+        self.cursor_x, self.cursor_y = x, y
+
+    def _place_run(self, words, widths, font_id):
+        # Same result as _place for words sharing one font, but a line at a time: with prefix sums of
+        # width + space, the first word that overflows a line is a bisect away.
+        space, advance = self.spaces[font_id], 1.25 * self.linespaces[font_id]
+        right = self.width - HMARGIN + space
+        offsets = list(accumulate(map(add, widths, repeat(space)), initial=0.0))
+        x, y = self.cursor_x, self.cursor_y
+        xs, ys = self.xs, self.ys
+        first, count = 0, len(words)
+        while first < count:
+            stop = bisect.bisect_right(offsets, right - x + offsets[first], first + 1) - 1
+            if stop == first:
+                y += advance
+                x = HMARGIN
+                stop = max(bisect.bisect_right(offsets, right - x + offsets[first], first + 1) - 1, first + 1)
+            base = x - offsets[first]
+            xs.fromlist([base + offset for offset in offsets[first:stop]])
+            ys.extend(array("d", [y]) * (stop - first))
+            x = base + offsets[stop]
+            first = stop
+        self.words.extend(words)
+        self.font_ids.extend(array("I", [font_id]) * count)
+        self.cursor_x, self.cursor_y = x, y
+
+    def _font_key(self):
+        return self.weight, self.style, self.size
+
+    def _font_id(self):
+        key = self._font_key()
+        font_id = self._font_ids.get(key)
+        if font_id is None:
+            font_id = self.intern_font(key, self.fonts.font(key))
+            self.spaces.append(self.fonts.measure(key, " "))
+            self.linespaces.append(self.fonts.linespace(key))
+        return font_id
+
+    def _log_font_cache(self, hits, misses):
+        hits, misses = self.fonts.hits - hits, self.fonts.misses - misses
+        if hits + misses:
+            logging.info("Font cache: %d hits, %d misses (%.0f%% hit rate)", hits, misses, 100 * hits / (hits + misses))
+
+
+class LazyLayout(Layout):
+    def __init__(self, tokens, fonts=FakeFont, width=WIDTH, lookahead=LAYOUT_LOOKAHEAD):
+        self.total_tokens = len(tokens) if hasattr(tokens, "__len__") else None
+        self.consumed_tokens = 0
+        self.complete = False
+        self.lookahead = lookahead
+        self._pending = iter(tokens)
+        super().__init__((), fonts, width)
+        self.ensure(0)
+
+    @property
+    def estimated_height(self):
+        if self.complete or not self.consumed_tokens or self.total_tokens is None:
+            return self.cursor_y
+        return self.cursor_y * self.total_tokens / self.consumed_tokens
+
+    def ensure(self, y):
+        # The cursor and the font/script/style state persist between calls, so this resumes mid-document.
+        limit = y + self.lookahead
+        if self.complete or self.cursor_y > limit:
+            return
+        with metrics.span("layout"):
+            while self.cursor_y <= limit:
+                tokens = list(islice(self._pending, LAZY_LAYOUT_TOKENS))
+                if not tokens:
+                    self.complete, self._pending = True, None
+                    break
+                self.consumed_tokens += len(tokens)
+                self.feed(tokens)
 
 
 if __name__ == '__main__':
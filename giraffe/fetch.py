@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from collections import defaultdict
+from io import BytesIO
+
+from giraffe.url import URL, MAX_CONNECTIONS_PER_HOST, Scheme, ssl_context
+
+logger = logging.getLogger(__name__)
+DEFAULT_CONCURRENCY = 16
+
+
+async def fetch_many(urls, concurrency=DEFAULT_CONCURRENCY, per_host=MAX_CONNECTIONS_PER_HOST):
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host))
+    urls = [URL(url) if isinstance(url, str) else url for url in urls]
+    # A failed page comes back as its exception, so one bad URL doesn't cost the rest of the batch.
+    return await asyncio.gather(*(fetch(url, limit, host_limits) for url in urls), return_exceptions=True)
+
+
+async def fetch(url, limit, host_limits):
+    url._follow_permanent_redirects()
+    while url.scheme in (Scheme.http, Scheme.https):
+        key = url._cache_key()
+        if (body := url._fresh_cached_body(key)) is not None:
+            return url.lex(body.decode(url._encoding))
+        async with host_limits[url._address], limit:
+            response = await _request(url)
+        if not url._redirect(response):
+            return url.lex(b"".join(url._iter_cached_body(key, response)).decode(url._encoding))
+    return await asyncio.to_thread(url.load)
+
+
+async def _request(url):
+    logger.debug("Opening async connection to %s", url._address)
+    if url.scheme == Scheme.https:
+        reader, writer = await asyncio.open_connection(*url._address, ssl=ssl_context(), server_hostname=url.host)
+    else:
+        reader, writer = await asyncio.open_connection(*url._address)
+    try:
+        writer.write(url._build_request().encode("utf8"))
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        preview = BytesIO(head)
+        _, status, _ = url._parse_statusline(preview)
+        url._parse_headers(preview)
+        body = b"" if int(status) in (204, 304) else await _read_raw_body(reader, url._headers)
+    finally:
+        writer.close()
+    return BytesIO(head + body)
+
+
+async def _read_raw_body(reader, headers):
+    if headers.get("transfer-encoding", "").casefold() == "chunked":
+        parts = []
+        while True:
+            size_line = await reader.readline()
+            parts.append(size_line)
+            size = int(size_line.split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            parts.append(await reader.readexactly(size + 2))
+        while True:
+            trailer = await reader.readline()
+            parts.append(trailer)
+            if trailer in (b"\r\n", b""):
+                break
+        return b"".join(parts)
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"]))
+    return await reader.read()
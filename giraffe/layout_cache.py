@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import struct
+import sys
+import threading
+from dataclasses import dataclass
+
+from giraffe.browser import WIDTH, FontCache, Layout
+from giraffe.store import LruStore
+from giraffe.url import CACHE_DIRECTORY, Text
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_CACHE_DIRECTORY = CACHE_DIRECTORY / "layouts"
+MEMORY_LAYOUT_CACHE_SIZE = 64 * 1024 * 1024
+LAYOUT_CACHE_SIZE = 512 * 1024 * 1024
+MAGIC = b"GLC2"
+HEADER = struct.Struct("<4sIQ")  # magic, length of the JSON metadata that follows, length of the whole entry
+
+
+@dataclass
+class LayoutCacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+class LayoutCache:
+    # Entries are kept encoded, in memory as on disk, so a Layout handed out and later reflowed
+    # can't change what the cache returns for its old width.
+    def __init__(self, directory=None, max_size=LAYOUT_CACHE_SIZE, max_memory=MEMORY_LAYOUT_CACHE_SIZE):
+        self.stats = LayoutCacheStats()
+        self._store = LruStore(directory, ".layout", max_size, max_memory)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(tokens):
+        return token_digest(tokens)
+
+    def layout(self, tokens, fonts, width=WIDTH, digest=None):
+        digest = digest or token_digest(tokens)
+        layout = self.lookup(digest, fonts, width)
+        if layout is None:
+            layout = Layout(tokens, fonts, width)
+            self.store(digest, layout)
+        return layout
+
+    def lookup(self, digest, fonts, width):
+        key = _key(digest, fonts, width)
+        data = self._store.get(key)
+        layout = None
+        if data is not None:
+            try:
+                layout = decode_layout(data, fonts)
+            except (struct.error, ValueError, KeyError, TypeError) as e:
+                logger.debug("Dropping damaged layout cache entry for %s: %s", key, e)
+            if layout is None:
+                self._store.discard(key)  # so the layout made after this miss replaces it
+        with self._lock:
+            if layout is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return layout
+
+    def store(self, digest, layout):
+        data = encode_layout(layout)
+        if data is not None:
+            self._store.put(_key(digest, layout.fonts, layout.width), data)
+
+
+def token_digest(tokens):
+    digest = hashlib.blake2b(digest_size=16)
+    for token in tokens:
+        if isinstance(token, Text):
+            encoded = token.text.encode("utf8")
+            digest.update(b"T%d:" % len(encoded))
+        else:
+            encoded = token.tag.encode("utf8")
+            digest.update(b"<%d:" % len(encoded))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def encode_layout(layout):
+    # The reflow items are stored as well as the display list, so a cached layout can still be resized.
+    # Words never contain whitespace, so they're newline-separated, with "" for a paragraph break.
+    if type(layout) is not Layout:
+        return None  # a LazyLayout isn't finished
+    words = "\n".join("" if word is None else word for word in layout.item_words)
+    if words.count("\n") != max(len(layout.item_words) - 1, 0):
+        return None
+    metadata = json.dumps({
+        "byteorder": sys.byteorder,
+        "width": layout.width,
+        "fonts": list(layout._font_ids),
+        "cursor": [layout.cursor_x, layout.cursor_y],
+        "items": len(layout.item_words),
+        "placed": len(layout),
+    }).encode("utf8")
+    columns = (layout.item_font_ids, layout.item_widths, layout.spaces, layout.linespaces,
+               layout.xs, layout.ys, layout.font_ids)
+    body = [metadata, *(column.tobytes() for column in columns), words.encode("utf8")]
+    size = HEADER.size + sum(map(len, body))
+    return b"".join([HEADER.pack(MAGIC, len(metadata), size), *body])
+
+
+def decode_layout(data, fonts):
+    # Returns None for an entry from another version or machine, and raises for a damaged one.
+    magic, length, size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        return None
+    if size != len(data):
+        raise ValueError(f"entry is {len(data)} bytes long, not {size}")
+    offset = HEADER.size + length
+    metadata = json.loads(data[HEADER.size:offset])
+    if metadata["byteorder"] != sys.byteorder:
+        return None
+    layout = Layout([], fonts, metadata["width"])
+    for key in metadata["fonts"]:
+        key = tuple(key)
+        layout.intern_font(key, layout.fonts.font(key))
+    items, placed, font_count = metadata["items"], metadata["placed"], len(metadata["fonts"])
+    view = memoryview(data)
+    for column, count in ((layout.item_font_ids, items), (layout.item_widths, items),
+                          (layout.spaces, font_count), (layout.linespaces, font_count),
+                          (layout.xs, placed), (layout.ys, placed), (layout.font_ids, placed)):
+        size = count * column.itemsize
+        if offset + size > len(view):
+            raise ValueError("entry ends inside its columns")
+        column.frombytes(view[offset:offset + size])
+        offset += size
+    words = bytes(view[offset:]).decode("utf8").split("\n") if items else []
+    layout.item_words = [word or None for word in words]
+    layout.words = [word for word in words if word]
+    if len(layout.item_words) != items or len(layout.words) != placed:
+        raise ValueError("entry has the wrong number of words")
+    layout.cursor_x, layout.cursor_y = metadata["cursor"]
+    return layout
+
+
+def _key(digest, fonts, width):
+    backend = fonts.fonts if isinstance(fonts, FontCache) else fonts
+    return f"{digest}:{backend.__module__}.{backend.__qualname__}:{width}"
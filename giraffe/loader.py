@@ -0,0 +1,61 @@
+import logging
+import queue
+import threading
+import time
+
+POLL_MS = 16
+MAX_TOKENS_PER_POLL = 4096  # keeps each poll short enough that the window stays responsive
+
+_DONE = object()
+
+
+class PageLoad:
+    def __init__(self, url, after, on_tokens, on_done):
+        self.url = url
+        self.started = time.perf_counter()
+        self._after = after  # Tk's window.after: everything but _fetch runs on the Tk thread
+        self._on_tokens = on_tokens
+        self._on_done = on_done
+        self._queue = queue.SimpleQueue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._fetch, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._after(POLL_MS, self._poll)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _fetch(self):
+        batches = self.url.stream_batches()  # one batch per network chunk, so tokens never wait for the next read
+        try:
+            for batch in batches:
+                if self.cancelled:
+                    return
+                self._queue.put(batch)
+            self._queue.put(_DONE)
+        except Exception as e:
+            logging.exception("Couldn't load %s", self.url)
+            self._queue.put(e)
+        finally:
+            batches.close()  # releases or closes the connection when cancelled mid-body
+
+    def _poll(self):
+        received = 0
+        while not self.cancelled and received < MAX_TOKENS_PER_POLL:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE or isinstance(item, Exception):
+                self._on_done(None if item is _DONE else item)
+                return
+            self._on_tokens(item)
+            received += len(item)
+        if not self.cancelled:
+            self._after(0 if received else POLL_MS, self._poll)
@@ -0,0 +1,191 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+STAGES = ("connect", "tls", "send", "ttfb", "body", "lex", "layout", "draw", "first_paint")
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+
+class NullSink:
+    enabled = False
+
+    def record(self, stage, seconds, size=0):
+        pass
+
+    def close(self):
+        pass
+
+
+class HistogramSink:
+    enabled = True
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.counts = Counter()
+        self.bytes = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, size=0):
+        with self._lock:
+            self.durations[stage].append(seconds)
+            self.counts[stage] += 1
+            self.bytes[stage] += size
+
+    def close(self):
+        pass
+
+    def total(self, stage):
+        return sum(self.durations[stage])
+
+    def percentile(self, stage, fraction):
+        durations = sorted(self.durations[stage])
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, int(fraction * len(durations)))]
+
+    def histogram(self, stage):
+        counts = [0] * len(BUCKETS_MS)
+        for seconds in self.durations[stage]:
+            counts[bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+        return list(zip(BUCKETS_MS, counts))
+
+    def summary(self):
+        return {
+            stage: {
+                "count": self.counts[stage],
+                "seconds": self.total(stage),
+                "bytes": self.bytes[stage],
+                "p50": self.percentile(stage, 0.5),
+                "p95": self.percentile(stage, 0.95),
+            }
+            for stage in self.durations
+        }
+
+
+class JsonLinesSink:
+    enabled = True
+
+    def __init__(self, file):
+        self._owned = isinstance(file, str) or hasattr(file, "__fspath__")
+        self.file = open(file, "a", encoding="utf-8") if self._owned else file
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, size=0):
+        line = json.dumps({"time": time.time(), "stage": stage, "seconds": seconds, "bytes": size})
+        with self._lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        if self._owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+sink = NullSink()
+_local = threading.local()
+
+
+def use_sink(new_sink):
+    global sink
+    previous, sink = sink, new_sink
+    return previous
+
+
+class Span:
+    # Time spent in nested spans is subtracted, so a lexer pulling from the network doesn't
+    # count the download as lexing.
+    __slots__ = ("stage", "size", "seconds", "_start", "_nested")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.size = 0
+        self.seconds = 0.0
+        self._nested = 0.0
+        self._start = None
+
+    def __enter__(self):
+        self.resume()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pause()
+        self.finish()
+
+    def add(self, size):
+        self.size += size
+
+    def resume(self):
+        self._nested = 0.0
+        _stack().append(self)
+        self._start = time.perf_counter()
+
+    def pause(self):
+        elapsed = time.perf_counter() - self._start
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1]._nested += elapsed
+        self.seconds += elapsed - self._nested
+
+    def finish(self):
+        sink.record(self.stage, self.seconds, self.size)
+
+
+class _NullSpan:
+    __slots__ = ()
+    seconds = 0.0
+    size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def add(self, size):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(stage):
+    if not sink.enabled:
+        return _NULL_SPAN
+    return Span(stage)
+
+
+def timed(stage, iterable, size=len):
+    if not sink.enabled:
+        return iterable
+    return _timed(Span(stage), iter(iterable), size)
+
+
+def _timed(span, iterator, size):
+    try:
+        while True:
+            span.resume()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                span.pause()
+            if size:
+                span.size += size(item)
+            yield item
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()
+        span.finish()
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+DISK_RESCAN_SECONDS = 60
+STALE_TEMPORARY_SECONDS = 3600  # a write left unfinished this long belongs to a process that died
+
+logger = logging.getLogger(__name__)
+
+
+class LruStore:
+    # Byte strings by key, kept in memory up to max_memory bytes and, given a directory, on disk up to
+    # max_size bytes, evicting the least recently used first. Several processes may share the directory:
+    # each writes whole files atomically, and rescans the directory to count what the others wrote before
+    # evicting and at least every DISK_RESCAN_SECONDS, so together they only overshoot max_size by what
+    # was written since their last rescan.
+    def __init__(self, directory, suffix, max_size, max_memory):
+        self.directory = pathlib.Path(directory) if directory else None
+        self.suffix = suffix
+        self.max_size = max_size
+        self.max_memory = max_memory
+        self._entries = OrderedDict()  # key -> data, least recently used first
+        self._memory = 0
+        self._disk = None  # file name -> size, least recently used first; scanned on first use
+        self._disk_size = 0
+        self._scanned = 0.0
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+            return self._load(key)
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+            self._save(key, data)
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._memory -= len(self._entries.pop(key))
+            if not self.directory:
+                return
+            path = self._path(key)
+            try:
+                self._disk_size -= self._disk_index().pop(path.name, 0)
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                logger.debug("Couldn't remove %s: %s", path, e)
+
+    def _remember(self, key, data):
+        if key in self._entries:
+            self._memory -= len(self._entries.pop(key))
+        if len(data) > self.max_memory:
+            return
+        self._entries[key] = data
+        self._memory += len(data)
+        while self._memory > self.max_memory:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory -= len(evicted)
+
+    def _path(self, key):
+        return self.directory / (hashlib.sha256(key.encode("utf8")).hexdigest() + self.suffix)
+
+    def _disk_index(self):
+        if self._disk is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            files = []
+            for path in self.directory.iterdir():
+                try:
+                    stat = path.stat()
+                    if path.suffix == ".tmp" and time.time() - stat.st_mtime > STALE_TEMPORARY_SECONDS:
+                        path.unlink()
+                    elif path.suffix == self.suffix:
+                        files.append((stat.st_mtime, path.name, stat.st_size))
+                except OSError:
+                    pass  # removed by another process since iterdir listed it
+            self._disk = OrderedDict((name, size) for _, name, size in sorted(files))
+            self._disk_size = sum(self._disk.values())
+            self._scanned = time.monotonic()
+        return self._disk
+
+    def _load(self, key):
+        # Reads even files missing from the index, since another process may have written them.
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            index = self._disk_index()
+        except OSError:
+            return None
+        self._disk_size += len(data) - index.pop(path.name, 0)
+        index[path.name] = len(data)
+        self._remember(key, data)
+        return data
+
+    def _save(self, key, data):
+        if not self.directory or len(data) > self.max_size:
+            return
+        path = self._path(key)
+        try:
+            index = self._disk_index()
+            _write_atomically(path, data)
+            self._disk_size += len(data) - index.pop(path.name, 0)
+            index[path.name] = len(data)
+            if self._disk_size > self.max_size or time.monotonic() - self._scanned > DISK_RESCAN_SECONDS:
+                self._evict()
+        except OSError as e:
+            logger.debug("Couldn't write %s for %s: %s", path, key, e)
+
+    def _evict(self):
+        self._disk = None  # rescan, to count files written by other processes
+        index = self._disk_index()
+        while self._disk_size > self.max_size:
+            name, size = index.popitem(last=False)
+            self._disk_size -= size
+            (self.directory / name).unlink(missing_ok=True)
+
+
+def _write_atomically(path, data):
+    # Readers, in this process or another, see the old file or the new one, never half of one.
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        pathlib.Path(temporary).unlink(missing_ok=True)
+        raise
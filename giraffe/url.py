@@ -1,17 +1,55 @@
+import argparse
+import codecs
+import email.utils
+import itertools
+import json
+import logging
+import mmap
 import os
 import pathlib
+import re
+import select
 import socket
 import ssl
 import sys
-from dataclasses import dataclass
+import threading
+import time
+import urllib.parse
+import zlib
+from array import array
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field
 from enum import StrEnum, auto
 from pprint import pformat
 
+from giraffe import metrics
+from giraffe.store import LruStore
+
 MAX_REDIRECTS = 10
+CHUNK_SIZE = 64 * 1024
+MAX_CONNECTIONS_PER_HOST = 6
+MAX_IDLE_CONNECTIONS = 32
+IDLE_TIMEOUT = 60.0
+POOL_TIMEOUT = 30.0
+MAX_PERMANENT_REDIRECTS = 256
+MAX_HANDSHAKES = 256  # recent TLS handshakes kept for inspection
+CACHE_SIZE = 256 * 1024 * 1024
+MEMORY_CACHE_SIZE = 32 * 1024 * 1024
+CACHE_DIRECTORY = pathlib.Path(os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache")) / "giraffe"
+UNCACHED_HEADERS = ("connection", "content-encoding", "content-length", "keep-alive", "transfer-encoding")
 
 DEFAULT_PAGE = "file://./example1-simple.html"
 
-_sockets = {}
+logger = logging.getLogger(__name__)
+
+_TAG_NAME = re.compile(r"\s*(\S*)")
+_ATTRIBUTE = re.compile(r"""([^\s=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|(\S+)))?""")
+
+_entities = None
+_ssl_context = None
+_tls_sessions = {}
+tls_handshakes = deque(maxlen=MAX_HANDSHAKES)  # most recent last
+_permanent_redirects = OrderedDict()  # least recently used first
 
 
 class Scheme(StrEnum):
@@ -21,29 +59,296 @@ class Scheme(StrEnum):
     data = auto()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Text:
     text: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Tag:
     tag: str
+    name: str = field(init=False, repr=False, compare=False)
+    _attributes: dict = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "name", _TAG_NAME.match(self.tag).group(1))
+
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            attributes = {}
+            for match in _ATTRIBUTE.finditer(self.tag, _TAG_NAME.match(self.tag).end()):
+                key, *values = match.groups()
+                attributes.setdefault(key.casefold(), next((value for value in values if value is not None), ""))
+            object.__setattr__(self, "_attributes", attributes)
+        return self._attributes
+
+
+TEXT, TAG, DECODED_TEXT, DECODED_TAG = range(4)
+
+
+class PackedTokens:
+    def __init__(self, body):
+        self.body = body
+        self.kinds = array("b")
+        # Spans into body; for decoded kinds, starts holds an index into self.decoded instead.
+        self.starts = array("q")
+        self.ends = array("q")
+        self.decoded = []
+
+    def append_span(self, kind, start, end):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def append_decoded(self, kind, text):
+        self.kinds.append(kind + DECODED_TEXT)
+        self.starts.append(len(self.decoded))
+        self.ends.append(0)
+        self.decoded.append(text)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        kind = self.kinds[index]
+        if kind >= DECODED_TEXT:
+            kind, text = kind - DECODED_TEXT, self.decoded[self.starts[index]]
+        else:
+            text = self.body[self.starts[index]:self.ends[index]]
+        return Text(text) if kind == TEXT else Tag(text)
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield self[index]
+
+    def texts(self):
+        body, decoded = self.body, self.decoded
+        for kind, start, end in zip(self.kinds, self.starts, self.ends):
+            if kind == TEXT:
+                yield body[start:end]
+            elif kind == DECODED_TEXT:
+                yield decoded[start]
+
+
+@dataclass
+class Handshake:
+    address: tuple
+    seconds: float
+    resumed: bool
+
+
+@dataclass
+class PoolStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class Connection:
+    def __init__(self, key, sock):
+        self.key = key
+        self.sock = sock
+        self.response = sock.makefile("rb")
+        self.idle_since = time.monotonic()
+        self.reused = False
+
+    def is_dropped(self):
+        # An idle keep-alive connection has nothing to say; readable means EOF or garbage.
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        return bool(readable)
+
+    def close(self):
+        self.response.close()
+        self.sock.close()
+
+
+class ConnectionPool:
+    def __init__(self, max_per_host=MAX_CONNECTIONS_PER_HOST, max_idle=MAX_IDLE_CONNECTIONS,
+                 idle_timeout=IDLE_TIMEOUT, timeout=POOL_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._idle = OrderedDict()  # least recently released first
+        self._open = Counter()
+        self._condition = threading.Condition()
+
+    def acquire(self, key, connect):
+        with self._condition:
+            deadline = time.monotonic() + self.timeout
+            while True:
+                self._evict_expired()
+                connection = self._take_idle(key)
+                if connection:
+                    self.stats.hits += 1
+                    logger.debug("Reusing connection to %s", key)
+                    return connection
+                if self._open[key] < self.max_per_host:
+                    break
+                if not self._condition.wait(deadline - time.monotonic()):
+                    raise PoolTimeout(key)
+            self._open[key] += 1
+            self.stats.misses += 1
+        try:
+            return Connection(key, connect())
+        except BaseException:
+            self._forget(key)
+            raise
+
+    def release(self, connection):
+        with self._condition:
+            connection.idle_since = time.monotonic()
+            connection.reused = True
+            self._idle[connection] = connection.key
+            while len(self._idle) > self.max_idle:
+                self._evict(next(iter(self._idle)))
+            # Waiters for every host share the condition, so wake them all: notify() might pick one
+            # waiting for another host, which would go back to sleep and lose the wakeup.
+            self._condition.notify_all()
+
+    def discard(self, connection):
+        connection.close()
+        self._forget(connection.key)
+
+    def close(self):
+        with self._condition:
+            while self._idle:
+                self._evict(next(iter(self._idle)))
+
+    def _take_idle(self, key):
+        for connection in reversed([c for c, k in self._idle.items() if k == key]):
+            del self._idle[connection]
+            if not connection.is_dropped():
+                return connection
+            logger.debug("Dropping stale connection to %s", key)
+            self.stats.evictions += 1
+            connection.close()
+            self._open[key] -= 1
+            self._condition.notify_all()
+        return None
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        while self._idle:
+            connection = next(iter(self._idle))
+            if now - connection.idle_since < self.idle_timeout:
+                break
+            self._evict(connection)
+
+    def _evict(self, connection):
+        del self._idle[connection]
+        self.stats.evictions += 1
+        connection.close()
+        self._open[connection.key] -= 1
+        self._condition.notify_all()
+
+    def _forget(self, key):
+        with self._condition:
+            self._open[key] -= 1
+            self._condition.notify_all()
+
+
+connection_pool = ConnectionPool()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    revalidations: int = 0
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    headers: dict
+    body: bytes
+    expires: float
+
+    def is_fresh(self):
+        return time.time() < self.expires
+
+    def encode(self):
+        metadata = {"key": self.key, "headers": self.headers, "expires": self.expires, "length": len(self.body)}
+        return json.dumps(metadata).encode("utf8") + b"\n" + self.body
+
+    @classmethod
+    def decode(cls, key, data):
+        line, _, body = data.partition(b"\n")
+        try:
+            metadata = json.loads(line)
+        except ValueError:
+            return None
+        if metadata.get("key") != key or metadata.get("length") != len(body):
+            return None
+        return cls(key, metadata["headers"], body, metadata["expires"])
+
+
+class HttpCache:
+    def __init__(self, directory=None, max_size=CACHE_SIZE, max_memory=MEMORY_CACHE_SIZE):
+        self.stats = CacheStats()
+        self._store = LruStore(directory, ".entry", max_size, max_memory)
+
+    def lookup(self, key):
+        data = self._store.get(key)
+        if data is None:
+            return None
+        entry = CacheEntry.decode(key, data)
+        if entry is None:
+            logger.debug("Dropping truncated cache entry for %s", key)
+            self._store.discard(key)
+        elif entry.is_fresh():
+            self.stats.hits += 1
+        return entry
+
+    def accepts(self, headers):
+        directives = _cache_control(headers)
+        if "no-store" in directives:
+            return False
+        return _expiry(headers) > time.time() or "etag" in headers or "last-modified" in headers
+
+    def store(self, key, headers, body):
+        headers = {header: value for header, value in headers.items() if header not in UNCACHED_HEADERS}
+        entry = CacheEntry(key, headers, body, _expiry(headers))
+        self._store.put(key, entry.encode())
+        return entry
+
+    def revalidate(self, entry, headers):
+        self.stats.revalidations += 1
+        return self.store(entry.key, {**entry.headers, **headers}, entry.body)
+
+
+http_cache = HttpCache()
+
+
+def use_disk_cache(directory=CACHE_DIRECTORY):
+    global http_cache
+    http_cache = HttpCache(directory)
 
 
 class URL:
+    html_lexer = None
+
     def __init__(self, url=DEFAULT_PAGE, redirect_count=0):
         if redirect_count >= MAX_REDIRECTS:
             raise TooManyRedirects
         self._headers = {}
         self._encoding = "utf-8"
         self._redirect_count = redirect_count
+        self._version = None
+        self._status = None
+        self._connection = None
+        self._cached = None
 
         if url.startswith("view-source:"):
             self.lexer = IdentityLexer
         else:
-            self.lexer = HtmlLexer
-        url = url.removeprefix("view-source:")
+            self.lexer = self.html_lexer or HtmlLexer
+        self._set_url(url.removeprefix("view-source:"))
+
+    def _set_url(self, url):
         scheme, url = url.split(":", 1)
         self.scheme = Scheme[scheme]
         if self.scheme == Scheme.http:
@@ -69,152 +374,391 @@ class URL:
             case Scheme.data:
                 self.path = url.removeprefix("text/html,")
 
+    def __str__(self):
+        match self.scheme:
+            case Scheme.http | Scheme.https:
+                return self._root + self.path
+            case Scheme.file:
+                return f"file://{self.path}"
+            case Scheme.data:
+                return f"data:text/html,{self.path}"
+
     def request(self):
+        decoder = codecs.getincrementaldecoder(self._encoding)()
+        content = "".join(decoder.decode(chunk) for chunk in self._iter_content())
+        return content + decoder.decode(b"", final=True)
+
+    def _iter_content(self):
+        self._follow_permanent_redirects()
         match self.scheme:
             case Scheme.http | Scheme.https:
-                content = self._do_http_request()
+                key = self._cache_key()
+                if (body := self._fresh_cached_body(key)) is not None:
+                    yield body
+                    return
+                try:
+                    response = self.get_http_response()
+                    redirected = self._redirect(response)
+                    if not redirected:
+                        yield from self._iter_cached_body(key, response)
+                except BaseException:
+                    self._close_connection()
+                    raise
+                if redirected:
+                    yield from self._iter_content()
+                    return
+                self._release_connection()
             case Scheme.file:
                 file_path = self.path
                 if os.sep != '/':
                     file_path = file_path.removeprefix('/')
-                with pathlib.Path(file_path).open(encoding="utf8", newline="\r\n") as f:
-                    content = "".join(f.readlines())
+                with pathlib.Path(file_path).open("rb") as f:
+                    yield from _iter_mapped(f)
             case Scheme.data:
-                content = self.path
-        return content
-
-    def get_http_response(self):
-        if (self._address, self.scheme) not in _sockets:
-            _debug(f"Creating new socket for {self._address}")
-            new_socket = socket.socket(
-                family=socket.AF_INET, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP
-            )
+                yield self.path.encode(self._encoding)
+
+    def _fresh_cached_body(self, key):
+        # Also keeps a stale entry in self._cached, so the request asks to revalidate it.
+        self._cached = http_cache.lookup(key)
+        if self._cached and self._cached.is_fresh():
+            logger.debug("Fresh cache entry for %s", key)
+            self._headers = dict(self._cached.headers)
+            return self._cached.body
+        return None
+
+    def _iter_cached_body(self, key, response):
+        if self._status == 304:
+            logger.debug("Revalidated cache entry for %s", key)
+            self._cached = http_cache.revalidate(self._cached, self._headers)
+            self._headers = {**self._cached.headers, **self._headers}
+            yield self._cached.body
+            return
+        http_cache.stats.misses += 1
+        chunks = metrics.timed("body", self._iter_body(response))
+        if not http_cache.accepts(self._headers):
+            yield from chunks
+            return
+        body = []
+        for chunk in chunks:
+            body.append(chunk)
+            yield chunk
+        http_cache.store(key, self._headers, b"".join(body))
+
+    def _cache_key(self):
+        path = self.path.split("#", 1)[0]
+        return f"{self.scheme}://{self.host.casefold()}:{self.port}{path}"
+
+    def get_http_response(self, retries=1):
+        self._connection = connection_pool.acquire((self._address, self.scheme), self._connect)
+        # The server may close an idle keep-alive connection just as we send on it. That's no fault
+        # of the request, and a GET is safe to send again, so retry it once on another connection.
+        retry = self._connection.reused and retries > 0
+        try:
+            responded = self._send_request()
+        except BaseException as e:
+            self._close_connection()
+            if not (retry and isinstance(e, OSError)):
+                raise
+            responded = False
+        if responded or not retry:
+            return self._connection.response
+        self._close_connection()
+        logger.debug("Reused connection to %s closed before responding, retrying", self._address)
+        return self.get_http_response(retries - 1)
+
+    def _send_request(self):
+        request = self._build_request().encode("utf8")
+        with metrics.span("send") as span:
+            self._connection.sock.sendall(request)
+            span.add(len(request))
+        with metrics.span("ttfb"):
+            return bool(self._connection.response.peek(1))
+
+    def _connect(self):
+        logger.debug("Creating new socket for %s", self._address)
+        new_socket = socket.socket(
+            family=socket.AF_INET, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP
+        )
+        with metrics.span("connect"):
             new_socket.connect(self._address)
-            if self.scheme == Scheme.https:
-                ctx = ssl.create_default_context()
-                new_socket = ctx.wrap_socket(new_socket, server_hostname=self.host)
-            _sockets[self._address, self.scheme] = new_socket
-        s = _sockets[self._address, self.scheme]
-        request = self._build_request()
-        s.send(request.encode("utf8"))
-        return s.makefile("rb", encoding="utf8", newline="\r\n")
+        if self.scheme == Scheme.https:
+            start = time.perf_counter()
+            with metrics.span("tls"):
+                new_socket = ssl_context().wrap_socket(
+                    new_socket, server_hostname=self.host, session=_tls_sessions.get(self._address)
+                )
+            handshake = Handshake(self._address, time.perf_counter() - start, new_socket.session_reused)
+            tls_handshakes.append(handshake)
+            logger.debug("TLS handshake with %s: %s", self._address, handshake)
+        return new_socket
 
     def _build_request(self):
-        request = f"GET {self.path} HTTP/1.0\r\n"
+        request = f"GET {self.path} HTTP/1.1\r\n"
         request += f"Host: {self.host}\r\n"
         request += "User-Agent: giraffe\r\n"
+        request += "Connection: keep-alive\r\n"
+        request += "Accept-Encoding: gzip, deflate\r\n"
+        if self._cached:
+            if etag := self._cached.headers.get("etag"):
+                request += f"If-None-Match: {etag}\r\n"
+            if last_modified := self._cached.headers.get("last-modified"):
+                request += f"If-Modified-Since: {last_modified}\r\n"
         request += "\r\n"
         return request
 
-    def _do_http_request(self):
-        response = self.get_http_response()
-        if self._redirect(response):
-            return self.request()
-        return self._parse_body(response)
-
     def _redirect(self, response):
-        version, status, explanation = self._parse_statusline(response)
-        status = int(status)
+        self._version, status, explanation = self._parse_statusline(response)
+        self._status = status = int(status)
         redirect = False
         match status:
             case 200:
                 pass
+            case 304 if self._cached:
+                pass
             case status if status in range(300, 400):
                 redirect = True
             case _:
                 raise ValueError(f"Can't handle status {status}")
         self._parse_headers(response)
         if redirect:
-            redirect_url = self._headers['location']
-            if redirect_url.startswith('/'):
-                redirect_url = self._root + redirect_url
-            self.__init__(redirect_url, self._redirect_count + 1)
+            source = self._cache_key()
+            target = urllib.parse.urljoin(str(self), self._headers['location'])
+            for _ in self._iter_transfer(response):
+                pass
+            self._release_connection()
+            if status in (301, 308):
+                _remember_permanent_redirect(source, target)
+            self._redirect_to(target)
+            logger.debug("Redirect %s: %s %s -> %s", self._redirect_count, status, source, target)
         return redirect
 
+    def _redirect_to(self, target):
+        if self._redirect_count + 1 >= MAX_REDIRECTS:
+            raise TooManyRedirects
+        self._redirect_count += 1
+        self._cached = None
+        if self.scheme in (Scheme.http, Scheme.https) and target.startswith(self._root + "/"):
+            self.path = target.removeprefix(self._root)
+        else:
+            self._set_url(target)
+
+    def _follow_permanent_redirects(self):
+        while self.scheme in (Scheme.http, Scheme.https):
+            source = self._cache_key()
+            target = _permanent_redirects.get(source)
+            if target is None:
+                break
+            _permanent_redirects.move_to_end(source)
+            self._redirect_to(target)
+            logger.debug("Redirect %s: cached permanent redirect %s -> %s", self._redirect_count, source, target)
+
     def _parse_body(self, response):
-        content_length = int(self._headers.get("content-length", 0))
-        _debug(f"expected content_length={content_length}")
-        if content_length:
-            content = response.read(content_length)
+        return b"".join(self._iter_body(response)).decode(self._encoding)
+
+    def _iter_body(self, response):
+        chunks = self._iter_transfer(response)
+        match self._headers.get("content-encoding", "identity").casefold():
+            case "identity":
+                yield from chunks
+            case "gzip" | "x-gzip":
+                yield from _inflate(chunks, zlib.MAX_WBITS | 16)
+            case "deflate":
+                yield from _inflate_deflate(chunks)
+            case encoding:
+                raise ValueError(f"Can't handle content-encoding {encoding}")
+
+    def _iter_transfer(self, response):
+        if self._status in (204, 304):
+            return
+        transfer_encoding = self._headers.get("transfer-encoding", "identity").casefold()
+        if transfer_encoding == "chunked":
+            yield from self._iter_chunked(response)
+        elif transfer_encoding != "identity":
+            raise ValueError(f"Can't handle transfer-encoding {transfer_encoding}")
+        elif "content-length" in self._headers:
+            content_length = int(self._headers["content-length"])
+            logger.debug("expected content_length=%s", content_length)
+            yield from _read_exactly(response, content_length)
         else:
-            content = response.read()
             self._headers["connection"] = "close"
-        _debug(f"got content_length={len(content)}")
-        return content.decode(self._encoding)
+            received = 0
+            while chunk := response.read1(CHUNK_SIZE):
+                received += len(chunk)
+                yield chunk
+            logger.debug("got content_length=%s", received)
+
+    def _iter_chunked(self, response):
+        while True:
+            size_line = response.readline()
+            if not size_line:
+                raise ValueError("Connection closed before the last chunk")
+            size = int(size_line.split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            yield from _read_exactly(response, size)
+            response.readline()
+        while response.readline() not in (b"\r\n", b""):
+            pass  # discard trailers
 
     def _parse_statusline(self, response):
         statusline = response.readline()
-        _debug(f"statusline: [{statusline}]")
+        logger.debug("statusline: [%s]", statusline)
         return statusline.decode(self._encoding).split(" ", 2)
 
     def _parse_headers(self, response):
         response_headers = {}
+        debug = logger.isEnabledFor(logging.DEBUG)
 
         while True:
             line = response.readline()
             if line == b'\r\n':
                 break
-            _debug(f"header line: [{line}]")
+            if debug:
+                logger.debug("header line: [%s]", line)
             header, value = line.decode(self._encoding).split(":", 1)
             response_headers[header.casefold()] = value.strip()
 
-        assert "transfer-encoding" not in response_headers
-        assert "content-encoding" not in response_headers
         self._headers = response_headers
-        _debug(f"Original headers: {pformat(self._headers)}")
+        if debug:
+            logger.debug("Original headers: %s", pformat(self._headers))
+
+    def _release_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        _remember_tls_session(connection)
+        if self._keep_alive():
+            connection_pool.release(connection)
+        else:
+            logger.debug("Closing socket for %s", self._address)
+            connection_pool.discard(connection)
+
+    def _close_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            connection_pool.discard(connection)
+
+    def _keep_alive(self):
+        connection = self._headers.get("connection", "").casefold()
+        if connection == "close":
+            return False
+        return self._version != "HTTP/1.0" or connection == "keep-alive"
 
     def load(self):
         body = self.request()
-        lexed = self.lex(body)
-
-        if self._headers.get("connection") == "close":
-            _debug(f"Closing socket for {self._address}")
-            _sockets.pop((self._address, self.scheme)).close()
-        else:
-            _debug(f"Headers were [{self._headers}]")
-        return lexed
+        return self.lex(body)
 
     def lex(self, body):
-        return self.lexer(body).lex()
+        with metrics.span("lex") as span:
+            tokens = self.lexer(body).lex()
+            span.add(len(body))
+        return tokens
 
+    def stream(self):
+        return metrics.timed("lex", self.lexer(encoding=self._encoding).stream(self._iter_content()), size=None)
 
-class IdentityLexer:
-    def __init__(self, body):
+    def stream_batches(self):
+        return metrics.timed("lex", self.lexer(encoding=self._encoding).batches(self._iter_content()), size=None)
+
+
+class Lexer:
+    def __init__(self, body="", encoding="utf-8"):
         self.body = body
+        self.tokens = []
+        self._decoder = codecs.getincrementaldecoder(encoding)()
 
     def lex(self):
-        return [Text(self.body)]
+        tokens = self._consume(self.body) + self._finish()
+        self.body = ""
+        return tokens
 
+    def feed(self, chunk):
+        return self._consume(self._decoder.decode(chunk))
 
-class HtmlLexer:
-    def __init__(self, body):
-        self.tokens = []
-        self.entity = ""
-        self.body = body
+    def close(self):
+        return self._consume(self._decoder.decode(b"", final=True)) + self._finish()
+
+    def stream(self, chunks):
+        for tokens in self.batches(chunks):
+            yield from tokens
+
+    def batches(self, chunks):
+        for chunk in chunks:
+            if tokens := self.feed(chunk):
+                yield tokens
+        if tokens := self.close():
+            yield tokens
+
+    def _consume(self, text):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+    def _take_tokens(self):
+        tokens, self.tokens = self.tokens, []
+        return tokens
+
+
+class IdentityLexer(Lexer):
+    def __init__(self, body="", encoding="utf-8"):
+        super().__init__(body, encoding)
+        self.buffer = []
 
     def lex(self):
-        buffer = ""
-        in_tag = False
-        for c in self.body:
+        tokens = [Text(self.body)] if self.body else []
+        self.body = ""
+        return tokens
+
+    def _consume(self, text):
+        # A word may straddle two chunks, so whatever follows the last whitespace waits for the next one.
+        if not text:
+            return []
+        split = len(text) if text[-1].isspace() else len(text) - len(text.rsplit(maxsplit=1)[-1])
+        if not split:
+            self.buffer.append(text)
+            return []
+        head = "".join(self.buffer) + text[:split]
+        self.buffer = [text[split:]] if split < len(text) else []
+        return [Text(head)]
+
+    def _finish(self):
+        tail, self.buffer = "".join(self.buffer), []
+        return [Text(tail)] if tail else []
+
+
+class HtmlLexer(Lexer):
+    def __init__(self, body="", encoding="utf-8"):
+        super().__init__(body, encoding)
+        self.entity = ""
+        self.buffer = ""
+        self.in_tag = False
+
+    def _consume(self, text):
+        for c in text:
             if c == "<":
-                in_tag = True
-                if buffer:
-                    self.tokens.append(Text(buffer))
-                buffer = ""
+                self.in_tag = True
+                if self.buffer:
+                    self.tokens.append(Text(self.buffer))
+                self.buffer = ""
             elif c == ">":
-                in_tag = False
-                self.tokens.append(Tag(buffer))
-                buffer = ""
-            elif in_tag:
-                buffer += c
+                self.in_tag = False
+                self.tokens.append(Tag(self.buffer))
+                self.buffer = ""
+            elif self.in_tag:
+                self.buffer += c
             else:
-                buffer += self._process_character_outside_tag(c)
+                self.buffer += self._process_character_outside_tag(c)
+        return self._take_tokens()
+
+    def _finish(self):
         if self.entity:
-            buffer += self.entity
-        if not in_tag and buffer:
-            self.tokens.append(Text(buffer))
-        self.body = ""
-        return self.tokens
+            self.buffer += self.entity
+            self.entity = ""
+        if not self.in_tag and self.buffer:
+            self.tokens.append(Text(self.buffer))
+        self.buffer = ""
+        return self._take_tokens()
 
     def _process_character_outside_tag(self, c):
         if c == "&" or self.entity:
@@ -229,40 +773,328 @@ class HtmlLexer:
             return c
 
 
+_TAG_DELIMITERS = re.compile("[<>]")
+_TEXT_DELIMITERS = re.compile("[<>&]")
+_ENTITY_DELIMITERS = re.compile("[<>;]")
+
+
+class FastHtmlLexer(Lexer):
+    def __init__(self, body="", encoding="utf-8"):
+        super().__init__(body, encoding)
+        self.entity = ""
+        self.buffer = []
+        self.in_tag = False
+
+    def _consume(self, text):
+        position, end = 0, len(text)
+        while position < end:
+            if self.in_tag:
+                delimiters = _TAG_DELIMITERS
+            elif self.entity:
+                delimiters = _ENTITY_DELIMITERS
+            else:
+                delimiters = _TEXT_DELIMITERS
+            match = delimiters.search(text, position)
+            stop = match.start() if match else end
+            if stop > position:
+                if self.entity and not self.in_tag:
+                    self.entity += text[position:stop]
+                else:
+                    self._append_slice(text, position, stop)
+            if not match:
+                break
+            position = stop + 1
+            match text[stop]:
+                case "<":
+                    self.in_tag = True
+                    self._emit_text()
+                case ">":
+                    self.in_tag = False
+                    self._emit_tag()
+                case "&":
+                    self.entity = "&"
+                case ";":
+                    self._append_decoded(parse_entity(self.entity + ";"))
+                    self.entity = ""
+        return self._take_tokens()
+
+    def _finish(self):
+        if self.entity:
+            self._append_decoded(self.entity)
+            self.entity = ""
+        if self.in_tag:
+            self._take_buffer()
+        else:
+            self._emit_text()
+        return self._take_tokens()
+
+    def _append_slice(self, text, start, stop):
+        self.buffer.append(text[start:stop])
+
+    def _append_decoded(self, text):
+        self.buffer.append(text)
+
+    def _emit_text(self):
+        buffer = self._take_buffer()
+        if buffer:
+            self.tokens.append(Text(buffer))
+
+    def _emit_tag(self):
+        self.tokens.append(Tag(self._take_buffer()))
+
+    def _take_buffer(self):
+        buffer = "".join(self.buffer)
+        self.buffer = []
+        return buffer
+
+
+class PackedHtmlLexer(FastHtmlLexer):
+    def __init__(self, body="", encoding="utf-8"):
+        super().__init__(body, encoding)
+        self.packed = PackedTokens(body)
+        self._pending = []  # decoded chunks, until close()
+        self._span = None  # while set, the whole buffer is this span of the body and self.buffer is empty
+
+    def lex(self):
+        self._consume(self.body)
+        self._finish()
+        self.body = ""
+        return self.packed
+
+    def feed(self, chunk):
+        # Spans index one body string, so the document is decoded in full and only packed on close().
+        self._pending.append(self._decoder.decode(chunk))
+        return []
+
+    def close(self):
+        self._pending.append(self._decoder.decode(b"", final=True))
+        self.body = self.packed.body = "".join(self._pending)
+        self._pending = []
+        return self.lex()
+
+    def stream(self, chunks):
+        for chunk in chunks:
+            self.feed(chunk)
+        yield from self.close()
+
+    def batches(self, chunks):
+        yield list(self.stream(chunks))
+
+    def _append_slice(self, text, start, stop):
+        if self._span is None and not self.buffer:
+            self._span = (start, stop)
+        else:
+            self._unpack_span()
+            self.buffer.append(text[start:stop])
+
+    def _append_decoded(self, text):
+        self._unpack_span()
+        self.buffer.append(text)
+
+    def _unpack_span(self):
+        if self._span:
+            start, stop = self._span
+            self.buffer.append(self.packed.body[start:stop])
+            self._span = None
+
+    def _emit_text(self):
+        if self._span:
+            self.packed.append_span(TEXT, *self._span)
+            self._span = None
+        elif buffer := self._take_buffer():
+            self.packed.append_decoded(TEXT, buffer)
+
+    def _emit_tag(self):
+        if self._span:
+            self.packed.append_span(TAG, *self._span)
+            self._span = None
+        else:
+            self.packed.append_decoded(TAG, self._take_buffer())
+
+    def _take_buffer(self):
+        self._unpack_span()
+        return super()._take_buffer()
+
+
+def ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+def _remember_tls_session(connection):
+    # TLS 1.3 tickets only arrive after the handshake, so grab the session once a response was read.
+    if isinstance(connection.sock, ssl.SSLSocket) and connection.sock.session is not None:
+        address, _ = connection.key
+        _tls_sessions[address] = connection.sock.session
+
+
+def _remember_permanent_redirect(source, target):
+    _permanent_redirects[source] = target
+    _permanent_redirects.move_to_end(source)
+    while len(_permanent_redirects) > MAX_PERMANENT_REDIRECTS:
+        _permanent_redirects.popitem(last=False)
+
+
+def _cache_control(headers):
+    directives = {}
+    for directive in headers.get("cache-control", "").split(","):
+        name, _, value = directive.partition("=")
+        if name.strip():
+            directives[name.strip().casefold()] = value.strip().strip('"')
+    return directives
+
+
+def _expiry(headers):
+    now = time.time()
+    directives = _cache_control(headers)
+    if "no-cache" in directives:
+        return now
+    try:
+        if "max-age" in directives:
+            return now + int(directives["max-age"]) - int(headers.get("age", 0))
+        if "expires" in headers:
+            return email.utils.parsedate_to_datetime(headers["expires"]).timestamp()
+    except (TypeError, ValueError):
+        pass
+    return now
+
+
+def _iter_mapped(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return  # empty files can't be mapped
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+        for start in range(0, len(view), CHUNK_SIZE):
+            # Chunks are views into the mapping, only valid until the next one is requested.
+            with view[start:start + CHUNK_SIZE] as chunk:
+                yield chunk
+
+
+def _read_exactly(response, length):
+    remaining = length
+    while remaining:
+        chunk = response.read1(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise ValueError(f"Connection closed {remaining} bytes before the end of the body")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _inflate(chunks, wbits):
+    decompressor = zlib.decompressobj(wbits)
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, CHUNK_SIZE)
+            if data:
+                yield data
+            chunk = decompressor.unconsumed_tail
+    if data := decompressor.flush():
+        yield data
+
+
+def _inflate_deflate(chunks):
+    # "deflate" should be zlib-wrapped, but some servers send a raw deflate stream.
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 2:
+            break
+    wrapped = len(head) >= 2 and head[0] & 0x0F == 8 and int.from_bytes(head[:2]) % 31 == 0
+    yield from _inflate(itertools.chain([head], chunks), zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+
+
 def parse_entity(entity):
-    match entity:
-        case "&lt;":
-            return "<"
-        case "&gt;":
-            return ">"
-        case "&amp;":
-            return "&"
-        case "&times;":
-            return "×"
-    return entity
+    if entity.startswith("&#"):
+        return _parse_numeric_entity(entity)
+    return _named_entities().get(entity[1:], entity)
 
 
-def _debug(*args, **kwargs):
-    print(*args, **kwargs, file=sys.stderr)
+def _parse_numeric_entity(entity):
+    digits = entity[2:].removesuffix(";")
+    try:
+        if digits[:1] in ("x", "X"):
+            codepoint = int(digits[1:], 16)
+        else:
+            codepoint = int(digits, 10)
+    except ValueError:
+        return entity
+    if codepoint == 0 or codepoint > 0x10FFFF or 0xD800 <= codepoint <= 0xDFFF:
+        return "\ufffd"
+    if 0x80 <= codepoint <= 0x9F:
+        try:
+            return bytes([codepoint]).decode("cp1252")  # HTML maps C1 controls as windows-1252
+        except UnicodeDecodeError:
+            pass
+    return chr(codepoint)
+
+
+def _named_entities():
+    global _entities
+    if _entities is None:
+        from html.entities import html5  # deferred so importing giraffe.url stays cheap
+        _entities = html5
+    return _entities
 
 
 class TooManyRedirects(Exception):
     pass
 
 
+class PoolTimeout(Exception):
+    pass
+
+
 def main():
-    import sys
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", nargs="*", default=[DEFAULT_PAGE])
+    parser.add_argument("--parallel", type=int, default=1, metavar="N", help="fetch up to N pages at once")
+    parser.add_argument("--no-cache", action="store_true", help="don't keep responses in the on-disk cache")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log connections, redirects and headers")
+    parser.add_argument("--metrics", metavar="FILE", help="append per-stage timings to FILE as JSON lines")
+    args = parser.parse_args()
 
-    if len(sys.argv) <= 1:
-        sys.argv.append(DEFAULT_PAGE)
-    for requested_url_string in sys.argv[1:]:
-        tokens = URL(requested_url_string).load()
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+
+    if args.metrics:
+        metrics.use_sink(metrics.JsonLinesSink(args.metrics))
+
+    if not args.no_cache:
+        use_disk_cache()
+
+    if args.parallel > 1:
+        import asyncio
+        from giraffe.fetch import fetch_many
+        pages = asyncio.run(fetch_many([URL(url) for url in args.urls], concurrency=args.parallel))
+    else:
+        pages = _load_each(args.urls)
+    failed = 0
+    for url, tokens in zip(args.urls, pages):
+        if isinstance(tokens, Exception):
+            failed += 1
+            print(f"Couldn't load {url}: {type(tokens).__name__}: {tokens}", file=sys.stderr)
+            continue
         rendered = strip_tags(tokens)
         encoded = rendered.encode("utf-8")  # Prevent UnicodeEncodeError when a PowerShell pipe implies cp1252
         print(encoded)
+    metrics.sink.close()
+    if failed:
+        sys.exit(f"{failed} of {len(args.urls)} pages failed")
+
+
+def _load_each(urls):
+    for url in urls:
+        try:
+            yield URL(url).load()
+        except Exception as e:
+            yield e
 
 
 def strip_tags(tokens):
+    if isinstance(tokens, PackedTokens):
+        return "".join(tokens.texts())
     return "".join([token.text for token in tokens if isinstance(token, Text)])
 
 
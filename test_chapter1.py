@@ -1,10 +1,26 @@
+import asyncio
+import email.utils
+import gzip
+import json
+import logging
 import pathlib
+import socket
+import subprocess
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import pytest
 
 import giraffe
-from giraffe.url import URL, parse_entity, TooManyRedirects, Tag, Text
+import giraffe.store
+from giraffe import metrics
+from conftest import Route
+from giraffe.fetch import fetch_many
+from giraffe.url import URL, ConnectionPool, HttpCache, PoolTimeout, parse_entity, TooManyRedirects, Tag, Text, HtmlLexer, FastHtmlLexer, \
+    PackedHtmlLexer, strip_tags
 
 EMPTY_HTML = "<!doctype html>\r\n<html>\r\n</html>\r\n"
 EXAMPLE_URL = "http://example.org/index.html"
@@ -36,9 +52,11 @@ def test_url_path():
 def test_build_request(example_url):
     expected_request = "\r\n".join(
         (
-            "GET /index.html HTTP/1.0",
+            "GET /index.html HTTP/1.1",
             "Host: example.org",
             "User-Agent: giraffe",
+            "Connection: keep-alive",
+            "Accept-Encoding: gzip, deflate",
             "\r\n",
         )
     )
@@ -73,6 +91,23 @@ def test_parse_headers(example_url, fake_response):
     assert example_url._headers["content-type"] == "text/html; charset=UTF-8"
 
 
+def test_debug_logging_is_lazy(example_url, fake_response, monkeypatch, caplog):
+    def fail(_):
+        raise AssertionError("pformat called with debug logging off")
+    monkeypatch.setattr(giraffe.url, "pformat", fail)
+    with caplog.at_level(logging.INFO, logger="giraffe.url"):
+        example_url._parse_statusline(fake_response)
+        example_url._parse_headers(fake_response)
+    assert caplog.records == []
+
+
+def test_debug_logging(example_url, fake_response, caplog):
+    with caplog.at_level(logging.DEBUG, logger="giraffe.url"):
+        example_url._parse_statusline(fake_response)
+        example_url._parse_headers(fake_response)
+    assert "Original headers: {'connection': 'close'," in caplog.text
+
+
 def test_parse_response(example_url, fake_response):
     _ = example_url._parse_statusline(fake_response)
     example_url._parse_headers(fake_response)
@@ -111,6 +146,30 @@ def test_file_scheme(tmp_path):
     assert file_url.request() == EMPTY_HTML
 
 
+def test_file_scheme_empty(tmp_path):
+    tmp_file = tmp_path / "empty.html"
+    tmp_file.write_bytes(b"")
+    assert URL(tmp_file.as_uri()).request() == ""
+
+
+def test_file_scheme_spans_chunks(tmp_path):
+    body = "<p>" + "x" * (giraffe.url.CHUNK_SIZE - 4) + "\u00e9\u4e00 &amp; end</p>\r\n" * 3
+    tmp_file = tmp_path / "large.html"
+    tmp_file.write_bytes(body.encode("utf-8"))
+    assert URL(tmp_file.as_uri()).request() == body
+    assert list(URL(tmp_file.as_uri()).stream()) == HtmlLexer(body).lex()
+
+
+def test_view_source_spans_chunks(tmp_path):
+    body = "x " * (giraffe.url.CHUNK_SIZE // 2 - 1) + "giraffe tail"
+    tmp_file = tmp_path / "large.html"
+    tmp_file.write_text(body)
+    url = "view-source:" + tmp_file.as_uri()
+    tokens = list(URL(url).stream())
+    assert "".join(token.text for token in tokens) == body
+    assert [word for token in tokens for word in token.text.split()] == body.split()
+
+
 def test_file_scheme_osx():
     file_url = URL("file:///Users/league/giraffe/example1-simple.html")
     assert file_url.path == "/Users/league/giraffe/example1-simple.html"
@@ -137,11 +196,134 @@ def test_entities():
     assert parse_entity("&unknown;") == "&unknown;"
 
 
+@pytest.mark.parametrize("entity,expected", (
+        ("&nbsp;", "\xa0"),
+        ("&mdash;", "\u2014"),
+        ("&times;", "\u00d7"),
+        ("&#8212;", "\u2014"),
+        ("&#x2014;", "\u2014"),
+        ("&#X2014;", "\u2014"),
+        ("&#150;", "\u2013"),
+        ("&#0;", "\ufffd"),
+        ("&#xD800;", "\ufffd"),
+        ("&#x110000;", "\ufffd"),
+        ("&#xZZ;", "&#xZZ;"),
+        ("&#;", "&#;"),
+))
+def test_more_entities(entity, expected):
+    assert parse_entity(entity) == expected
+
+
+def test_entity_table_is_not_loaded_at_import():
+    code = "import sys, giraffe.url; assert 'html.entities' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
 def test_entities_in_html():
     url = URL("data:text/html,<http>hello &lt;&unknown;&gt;</http>")
     assert url.load() == [Tag("http"), Text("hello <&unknown;>"), Tag("/http")]
 
 
+STREAMED_HTML = '<p class="x">caf\u00e9 &lt;b&gt; &amp</p>tail &unknown; &gt'
+
+
+@pytest.mark.parametrize("chunk_size", (1, 2, 3, 7, 64))
+def test_streaming_lexer_matches_lex(chunk_size):
+    expected = HtmlLexer(STREAMED_HTML).lex()
+    encoded = STREAMED_HTML.encode("utf-8")
+    lexer = HtmlLexer()
+    chunks = [encoded[i:i + chunk_size] for i in range(0, len(encoded), chunk_size)]
+    assert list(lexer.stream(chunks)) == expected
+
+
+def test_streaming_lexer_yields_complete_tokens():
+    lexer = HtmlLexer()
+    assert lexer.feed(b"<htm") == []
+    assert lexer.feed(b"l>hello &l") == [Tag("html")]
+    assert lexer.feed(b"t;<") == [Text("hello <")]
+    assert lexer.feed(b"/html>") == [Tag("/html")]
+    assert lexer.close() == []
+
+
+@pytest.mark.parametrize("body", (
+        EMPTY_HTML,
+        STREAMED_HTML,
+        "<a<b>c>d",
+        "&a<b>c; tail",
+        "x &lt",
+        "<unclosed &amp;",
+        "a > b ; c",
+        "&&amp;;",
+))
+def test_fast_lexer_matches_html_lexer(body):
+    assert FastHtmlLexer(body).lex() == HtmlLexer(body).lex()
+
+
+@pytest.mark.parametrize("body", (
+        EMPTY_HTML,
+        STREAMED_HTML,
+        "<a<b>c>d",
+        "&a<b>c; tail",
+        "x &lt",
+        "<unclosed &amp;",
+        "a > b ; c",
+        "&&amp;;",
+        "<p title=\"&amp;\">x&lt;y</p>",
+))
+def test_packed_lexer_matches_fast_lexer(body):
+    assert list(PackedHtmlLexer(body).lex()) == FastHtmlLexer(body).lex()
+
+
+def test_packed_lexer_feed_and_close():
+    lexer = PackedHtmlLexer()
+    assert lexer.feed("<b>hel\u00e9".encode()[:-1]) == []
+    assert lexer.feed("\u00e9".encode()[-1:] + b"lo</b> world") == []
+    assert list(lexer.close()) == [Tag("b"), Text("hel\u00e9lo"), Tag("/b"), Text(" world")]
+
+
+def test_packed_tokens_slice_the_body():
+    tokens = PackedHtmlLexer('<p class="x">caf\u00e9</p>tail').lex()
+    assert tokens.decoded == []
+    assert tokens[0] == Tag('p class="x"')
+    assert strip_tags(tokens) == "caf\u00e9tail"
+
+
+def test_packed_tokens_decode_entities():
+    tokens = PackedHtmlLexer("a &lt; b<br>").lex()
+    assert tokens.decoded == ["a < b"]
+    assert strip_tags(tokens) == "a < b"
+
+
+def test_tag_name_and_attributes():
+    tag = Tag(""" img src=x alt='a b' hidden ID="y" """)
+    assert tag.name == "img"
+    assert tag.attributes == {"src": "x", "alt": "a b", "hidden": "", "id": "y"}
+    assert tag == Tag(tag.tag)
+    assert Tag("").name == ""
+
+
+def test_tokens_have_no_dict():
+    assert not hasattr(Text("a"), "__dict__")
+    assert not hasattr(Tag("a"), "__dict__")
+
+
+def test_fast_lexer_streams():
+    encoded = STREAMED_HTML.encode("utf-8")
+    chunks = [encoded[i:i + 3] for i in range(0, len(encoded), 3)]
+    assert list(FastHtmlLexer().stream(chunks)) == HtmlLexer(STREAMED_HTML).lex()
+
+
+def test_select_html_lexer(monkeypatch):
+    monkeypatch.setattr(URL, "html_lexer", FastHtmlLexer)
+    assert URL("data:text/html,hi").lexer is FastHtmlLexer
+    assert URL("view-source:data:text/html,hi").lexer is giraffe.url.IdentityLexer
+
+
+def test_stream_data_url():
+    url = URL("data:text/html,<b>hello</b>")
+    assert list(url.stream()) == [Tag("b"), Text("hello"), Tag("/b")]
+
+
 def test_long_tag():
     url = URL(
         'data:text/html,<img height="1" width="1" style="display:none" alt="fbpx" src="https://www.facebook.com/tr?id=1218016184890789&ev=PageView&noscript=1"/>')
@@ -194,6 +376,25 @@ def test_relative_redirect(example_url):
     assert example_url.path == expected_path
 
 
+@pytest.mark.parametrize("location,expected_path", (
+        ("other.html", "/docs/other.html"),
+        ("../up.html", "/up.html"),
+        ("?page=2", "/docs/index.html?page=2"),
+        ("//example.org/abs.html", "/abs.html"),
+))
+def test_relative_redirect_resolution(location, expected_path):
+    url = URL("http://example.org/docs/index.html")
+    assert url._redirect(_redirect(location))
+    assert (url.host, url.path) == ("example.org", expected_path)
+
+
+def test_redirect_to_other_host():
+    url = URL("view-source:http://example.org/index.html")
+    assert url._redirect(_redirect("https://example.com:8443/new"))
+    assert (url.scheme, url.host, url.port, url.path) == ("https", "example.com", 8443, "/new")
+    assert url.lexer is giraffe.url.IdentityLexer
+
+
 def test_too_many_redirects():
     fake_response = _redirect("/")
     max_redirects = 10
@@ -207,3 +408,316 @@ def _redirect(location):
 Location: {location}
 
 """)
+
+
+@pytest.fixture
+def socket_pairs():
+    pairs = []
+
+    def connect():
+        pairs.append(socket.socketpair())
+        return pairs[-1][0]
+
+    yield connect, pairs
+    for client, server in pairs:
+        client.close()
+        server.close()
+
+
+def test_pool_reuses_released_connection(socket_pairs):
+    connect, _ = socket_pairs
+    pool = ConnectionPool()
+    first = pool.acquire("host", connect)
+    pool.release(first)
+    assert pool.acquire("host", connect) is first
+    assert (pool.stats.hits, pool.stats.misses) == (1, 1)
+
+
+def test_pool_drops_half_closed_connection(socket_pairs):
+    connect, pairs = socket_pairs
+    pool = ConnectionPool()
+    first = pool.acquire("host", connect)
+    pool.release(first)
+    pairs[0][1].close()
+    assert pool.acquire("host", connect) is not first
+    assert (pool.stats.hits, pool.stats.misses, pool.stats.evictions) == (0, 2, 1)
+
+
+def test_pool_evicts_idle_connections(socket_pairs):
+    connect, _ = socket_pairs
+    pool = ConnectionPool(idle_timeout=0)
+    pool.release(pool.acquire("host", connect))
+    pool.acquire("host", connect)
+    assert (pool.stats.hits, pool.stats.misses, pool.stats.evictions) == (0, 2, 1)
+
+
+def test_pool_evicts_least_recently_used(socket_pairs):
+    connect, _ = socket_pairs
+    pool = ConnectionPool(max_idle=1)
+    a, b = pool.acquire("a", connect), pool.acquire("b", connect)
+    pool.release(a)
+    pool.release(b)
+    assert pool.stats.evictions == 1
+    assert pool.acquire("b", connect) is b
+
+
+def test_pool_limits_connections_per_host(socket_pairs):
+    connect, _ = socket_pairs
+    pool = ConnectionPool(max_per_host=1, timeout=0.01)
+    first = pool.acquire("host", connect)
+    with pytest.raises(PoolTimeout):
+        pool.acquire("host", connect)
+    pool.discard(first)
+    pool.acquire("host", connect)
+
+
+def _closed_socket():
+    client, server = socket.socketpair()
+    server.close()
+    return client
+
+
+def test_failed_request_gives_back_its_connection(cache, monkeypatch):
+    pool = ConnectionPool(max_per_host=1, timeout=0.01)
+    monkeypatch.setattr(giraffe.url, "connection_pool", pool)
+    monkeypatch.setattr(URL, "_connect", lambda self: _closed_socket())
+    for _ in range(3):
+        with pytest.raises((OSError, ValueError)):
+            URL(EXAMPLE_URL).request()
+    assert sum(pool._open.values()) == 0
+
+
+def test_pool_wakes_waiter_for_released_host(socket_pairs):
+    connect, _ = socket_pairs
+    pool = ConnectionPool(max_per_host=1, timeout=5)
+    a, b = pool.acquire("a", connect), pool.acquire("b", connect)
+    with ThreadPoolExecutor(2) as executor:
+        waiting_for_b = executor.submit(pool.acquire, "b", connect)
+        time.sleep(0.05)
+        waiting_for_a = executor.submit(pool.acquire, "a", connect)
+        time.sleep(0.05)
+        pool.release(a)
+        assert waiting_for_a.result(timeout=1) is a
+        pool.release(b)
+        assert waiting_for_b.result(timeout=1) is b
+
+
+PAGE = b"<p>" + b"hello world " * 200 + b"</p>"
+
+
+def test_fetch_reuses_connection(http_server, pool):
+    http_server.routes["/page"] = Route(PAGE)
+    for _ in range(3):
+        assert URL(http_server.url("/page")).request() == PAGE.decode()
+    assert (pool.stats.hits, pool.stats.misses) == (2, 1)
+    _, headers = http_server.requests[0]
+    assert headers["Accept-Encoding"] == "gzip, deflate"
+
+
+def test_retry_when_reused_connection_was_closed(http_server, pool, monkeypatch):
+    http_server.routes["/page"] = Route(PAGE)
+    URL(http_server.url("/page")).request()
+    next(iter(pool._idle)).sock.shutdown(socket.SHUT_WR)
+    monkeypatch.setattr(giraffe.url.Connection, "is_dropped", lambda self: False)  # lose the race
+    assert URL(http_server.url("/page")).request() == PAGE.decode()
+    assert (pool.stats.hits, pool.stats.misses) == (1, 2)
+
+
+def test_metrics_record_pipeline_stages(http_server, recorded_metrics):
+    http_server.routes["/page"] = Route(PAGE)
+    URL(http_server.url("/page")).load()
+    list(URL(http_server.url("/page")).stream())
+    assert recorded_metrics.counts == {"connect": 1, "send": 2, "ttfb": 2, "body": 2, "lex": 2}
+    assert recorded_metrics.bytes["body"] == 2 * len(PAGE)
+    assert sum(count for _, count in recorded_metrics.histogram("body")) == 2
+
+
+def test_metrics_exclude_nested_spans(recorded_metrics):
+    with metrics.span("lex") as outer:
+        with metrics.span("body"):
+            time.sleep(0.05)
+    assert recorded_metrics.total("body") >= 0.05
+    assert outer.seconds < 0.01
+
+
+def test_metrics_disabled_by_default():
+    chunks = [b"a"]
+    assert metrics.span("lex") is metrics.span("body")
+    assert metrics.timed("body", chunks) is chunks
+
+
+def test_json_lines_sink(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    sink = metrics.JsonLinesSink(path)
+    sink.record("body", 0.5, 10)
+    sink.close()
+    record = json.loads(path.read_text())
+    assert (record["stage"], record["seconds"], record["bytes"]) == ("body", 0.5, 10)
+
+
+def _deflate(data, wbits):
+    compressor = zlib.compressobj(wbits=wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.parametrize("route", (
+        Route(PAGE, chunked=True),
+        Route(gzip.compress(PAGE), headers={"Content-Encoding": "gzip"}),
+        Route(gzip.compress(PAGE), headers={"Content-Encoding": "gzip"}, chunked=True),
+        Route(_deflate(PAGE, zlib.MAX_WBITS), headers={"Content-Encoding": "deflate"}, chunked=True),
+        Route(_deflate(PAGE, -zlib.MAX_WBITS), headers={"Content-Encoding": "deflate"}),
+), ids=("chunked", "gzip", "gzip-chunked", "deflate", "raw-deflate"))
+def test_fetch_encoded_body(http_server, pool, route):
+    http_server.routes["/page"] = route
+    for _ in range(2):
+        assert URL(http_server.url("/page")).request() == PAGE.decode()
+    assert pool.stats.hits == 1
+
+
+def test_stream_gzip_chunked(http_server):
+    http_server.routes["/page"] = Route(gzip.compress(PAGE), headers={"Content-Encoding": "gzip"}, chunked=True)
+    assert list(URL(http_server.url("/page")).stream()) == HtmlLexer(PAGE.decode()).lex()
+
+
+def test_https_resumes_tls_session(https_server):
+    https_server.routes["/page"] = Route(PAGE, headers={"Connection": "close"})
+    for _ in range(3):
+        assert URL(https_server.url("/page")).request() == PAGE.decode()
+    address = ("127.0.0.1", https_server.server_address[1])
+    handshakes = [handshake for handshake in giraffe.url.tls_handshakes if handshake.address == address]
+    assert [handshake.resumed for handshake in handshakes] == [False, True, True]
+    assert giraffe.url.ssl_context() is giraffe.url.ssl_context()
+
+
+def test_fetch_many(http_server):
+    http_server.routes["/page"] = Route(gzip.compress(PAGE), headers={"Content-Encoding": "gzip"}, chunked=True)
+    http_server.routes["/moved"] = Route(status=301, headers={"Location": "/page"})
+    http_server.routes["/other"] = Route(b"<b>other</b>")
+    urls = [http_server.url(path) for path in ("/page", "/moved", "/other")] + ["data:text/html,<i>data</i>"]
+    pages = asyncio.run(fetch_many(urls))
+    assert pages == [URL(url).load() for url in urls]
+
+
+def test_fetch_many_keeps_pages_after_a_failure(http_server):
+    http_server.routes["/page"] = Route(PAGE)
+    urls = [http_server.url("/page"), http_server.url("/missing"), http_server.url("/page")]
+    first, missing, last = asyncio.run(fetch_many(urls))
+    assert first == last == HtmlLexer(PAGE.decode()).lex()
+    assert isinstance(missing, ValueError)
+
+
+@pytest.mark.parametrize("parallel", ("1", "2"))
+def test_cli_reports_failed_urls(http_server, monkeypatch, capsys, parallel):
+    http_server.routes["/page"] = Route(b"<b>fine</b>")
+    urls = [http_server.url("/missing"), http_server.url("/page")]
+    monkeypatch.setattr(sys, "argv", ["giraffe.url", "--no-cache", "--parallel", parallel, *urls])
+    with pytest.raises(SystemExit, match="1 of 2 pages failed"):
+        giraffe.url.main()
+    out, err = capsys.readouterr()
+    assert out == "b'fine'\n"
+    assert f"Couldn't load {urls[0]}: ValueError" in err
+
+
+@pytest.mark.parametrize("concurrency,per_host,expected", ((2, 6, 2), (6, 3, 3)))
+def test_fetch_many_limits_concurrency(http_server, concurrency, per_host, expected):
+    http_server.routes["/slow"] = Route(b"slow", delay=0.05)
+    asyncio.run(fetch_many([http_server.url("/slow")] * 8, concurrency=concurrency, per_host=per_host))
+    assert http_server.max_in_flight == expected
+
+
+def test_fetch_many_uses_cache(http_server, cache):
+    http_server.routes["/fresh"] = Route(PAGE, headers={"Cache-Control": "max-age=60"})
+    http_server.routes["/etag"] = Route(PAGE, headers={"ETag": '"v1"', "Cache-Control": "no-cache"})
+    urls = [http_server.url("/fresh"), http_server.url("/etag")]
+    for _ in range(2):
+        assert asyncio.run(fetch_many(urls)) == [HtmlLexer(PAGE.decode()).lex()] * 2
+    assert len(http_server.requests) == 3
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.revalidations) == (1, 2, 1)
+
+
+def _fetch_twice(server, route):
+    server.routes["/page"] = route
+    for _ in range(2):
+        assert URL(server.url("/page")).request() == route.body.decode()
+    return len(server.requests)
+
+
+def test_cache_fresh_response(http_server, cache):
+    assert _fetch_twice(http_server, Route(PAGE, headers={"Cache-Control": "max-age=60"})) == 1
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+def test_cache_expires(http_server, cache):
+    expires = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert _fetch_twice(http_server, Route(PAGE, headers={"Expires": expires})) == 1
+
+
+@pytest.mark.parametrize("headers", (
+        {"Cache-Control": "no-store, max-age=60"},
+        {"Cache-Control": "max-age=0"},
+        {},
+))
+def test_cache_skips_uncacheable(http_server, cache, headers):
+    assert _fetch_twice(http_server, Route(PAGE, headers=headers)) == 2
+    assert cache.stats.hits == 0
+
+
+@pytest.mark.parametrize("headers", (
+        {"ETag": '"v1"', "Cache-Control": "no-cache"},
+        {"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+))
+def test_cache_revalidates(http_server, cache, headers):
+    route = Route(gzip.compress(PAGE), headers={"Content-Encoding": "gzip", **headers})
+    http_server.routes["/page"] = route
+    for _ in range(2):
+        assert URL(http_server.url("/page")).request() == PAGE.decode()
+    _, conditional = http_server.requests[1]
+    assert conditional["If-None-Match"] == headers.get("ETag")
+    assert conditional["If-Modified-Since"] == headers.get("Last-Modified")
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.revalidations) == (0, 1, 1)
+
+
+def test_cache_persists_to_disk(http_server, monkeypatch, tmp_path):
+    monkeypatch.setattr(giraffe.url, "http_cache", HttpCache(tmp_path))
+    http_server.routes["/page"] = Route(PAGE, headers={"Cache-Control": "max-age=60"})
+    URL(http_server.url("/page")).request()
+    monkeypatch.setattr(giraffe.url, "http_cache", HttpCache(tmp_path))
+    assert URL(http_server.url("/page")).request() == PAGE.decode()
+    assert len(http_server.requests) == 1
+    assert giraffe.url.http_cache.stats.hits == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = HttpCache(tmp_path, max_size=2500, max_memory=0)
+    headers = {"cache-control": "max-age=60"}
+    for key in "abc":
+        cache.store(key, headers, b"x" * 1000)
+    assert [HttpCache(tmp_path).lookup(key) is not None for key in "abc"] == [False, True, True]
+
+
+def test_cache_counts_entries_written_by_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(giraffe.store, "DISK_RESCAN_SECONDS", 0)
+    caches = [HttpCache(tmp_path, max_size=2500, max_memory=0) for _ in range(2)]
+    for cache, key in zip(caches * 2, "abc"):
+        cache.store(key, {"cache-control": "max-age=60"}, b"x" * 1000)
+    assert [HttpCache(tmp_path).lookup(key) is not None for key in "abc"] == [False, True, True]
+
+
+@pytest.mark.parametrize("keep", (-500, 10))
+def test_cache_drops_truncated_entries(tmp_path, keep):
+    HttpCache(tmp_path).store("a", {"cache-control": "max-age=60"}, b"x" * 1000)
+    [path] = tmp_path.glob("*.entry")
+    path.write_bytes(path.read_bytes()[:keep])
+    assert HttpCache(tmp_path).lookup("a") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("status,requests", ((301, 3), (308, 3), (302, 4)))
+def test_permanent_redirects_are_remembered(http_server, status, requests):
+    http_server.routes["/old"] = Route(b"moved", status=status, headers={"Location": "/page"})
+    http_server.routes["/page"] = Route(PAGE)
+    for _ in range(2):
+        url = URL(http_server.url("/old"))
+        assert url.request() == PAGE.decode()
+        assert (url.path, url._redirect_count) == ("/page", 1)
+    assert len(http_server.requests) == requests
@@ -1,7 +1,17 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import giraffe.batch
 import giraffe.browser
+import giraffe.url
+from giraffe.batch import render_batch, render_page
+from giraffe.layout_cache import LayoutCache, decode_layout, encode_layout, token_digest
 from conftest import ORIGIN, SCROLL_AMOUNT
-from giraffe.url import Text, Tag
-from giraffe.browser import Layout
+from giraffe.url import Text, Tag, FastHtmlLexer, PackedHtmlLexer
+from giraffe.browser import Layout, LazyLayout, HeadlessBrowser
 
 HSTEP, VSTEP = 17, 23
 LINE_HEIGHT = 1.25 * VSTEP
@@ -30,6 +40,13 @@ def test_scroll_down(browser):
     assert browser.scroll == SCROLL_AMOUNT
 
 
+def test_browser_records_layout_and_draw(sample_url, recorded_metrics):
+    browser = giraffe.browser.HeadlessBrowser()
+    browser.load(sample_url)
+    browser.scroll_down(None)
+    assert recorded_metrics.counts == {"lex": 1, "layout": 1, "draw": 2}
+
+
 def test_scroll_up(browser):
     assert browser.scroll == 0
     browser.scroll = SCROLL_AMOUNT
@@ -81,3 +98,233 @@ def test_resize(browser):
     browser.resize(MockEvent())
     assert_text_location(browser.display_list[1], (ORIGIN[0], ORIGIN[1] + LINE_HEIGHT), expected_text)
     assert browser.height == 400
+
+
+def test_reflow_matches_fresh_layout():
+    tokens = [Text("A B C D"), Tag("br"), Tag("b"), Text("bold words here"), Tag("/b"), Tag("/p"), Text("E F")]
+    layout = Layout(tokens)
+    for width in (5 * HSTEP, 9 * HSTEP, 800):
+        layout.reflow(width)
+        assert list(layout) == list(Layout(tokens, width=width))
+
+
+def test_layout_accepts_packed_tokens():
+    body = "<p>one <b>two</b> &amp; three</p><script>x</script>"
+    expected = Layout(FastHtmlLexer(body).lex())
+    actual = Layout(PackedHtmlLexer(body).lex())
+    assert list(actual) == list(expected)
+
+
+def test_visible_range():
+    layout = Layout([Text("A " * 2000)])
+    start, end = layout.visible_range(1000, 200)
+    assert start > 0 and end < len(layout)
+    browser = giraffe.browser.HeadlessBrowser()
+    browser.scroll, browser.height = 1000, 200
+    visible = [i for i, ((_, y), _, _) in enumerate(layout) if not browser._is_offscreen(y)]
+    assert (start, end) == (visible[0], visible[-1] + 1)
+
+
+class FakeCanvas:
+    def __init__(self):
+        self.items = {}
+        self.calls = 0
+
+    def create_text(self, x, y, word, font):
+        self.calls += 1
+        self.items[self.calls] = [x, y]
+        return self.calls
+
+    def delete(self, item):
+        self.calls += 1
+        if item == "all":
+            self.items.clear()
+        else:
+            del self.items[item]
+
+    def move(self, item, dx, dy):
+        self.calls += 1
+        for coords in self.items.values():
+            coords[1] += dy
+
+
+def test_retained_canvas_moves_items_when_scrolling():
+    layout = Layout([Text("A " * 5000)])
+    canvas = FakeCanvas()
+    painter = giraffe.browser.RetainedCanvas(canvas, canvas.create_text)
+    created = painter.draw(layout, 0, giraffe.browser.HEIGHT)
+    assert created == len(canvas.items) > 0
+    calls = canvas.calls
+    assert painter.draw(layout, SCROLL_AMOUNT, giraffe.browser.HEIGHT) == 0
+    assert canvas.calls == calls + 1
+    start, end = painter.band
+    for index, coords in zip(range(start, end), canvas.items.values()):
+        (x, y), _, _ = layout[index]
+        assert coords == [x, y - SCROLL_AMOUNT]
+
+
+def test_retained_canvas_only_touches_items_entering_and_leaving():
+    layout = Layout([Text("A " * 5000)])
+    canvas = FakeCanvas()
+    painter = giraffe.browser.RetainedCanvas(canvas, canvas.create_text)
+    painter.draw(layout, 0, giraffe.browser.HEIGHT)
+    for scroll in range(0, 5000, 100):
+        painter.draw(layout, scroll, giraffe.browser.HEIGHT)
+        start, end = painter.band
+        assert len(canvas.items) == end - start
+        assert layout.visible_range(scroll, giraffe.browser.HEIGHT)[1] <= end
+    layout.reflow(400)
+    assert painter.draw(layout, 0, giraffe.browser.HEIGHT) == len(canvas.items)
+
+
+def test_display_list_indexing():
+    layout = Layout([Text("A B"), Tag("b"), Text("C")])
+    assert len(layout) == 3
+    assert layout[-1] == ((ORIGIN[0] + 4 * HSTEP, ORIGIN[1]), "C", giraffe.browser.FakeFont(weight="bold"))
+    assert layout[1:] == list(layout)[1:]
+    assert layout.font_table == [giraffe.browser.FakeFont(), giraffe.browser.FakeFont(weight="bold")]
+    assert list(layout.font_ids) == [0, 0, 1]
+
+
+LONG_PAGE = "".join(f"<p>paragraph {i} <b>with</b> <i>some</i> words</p>" for i in range(2000))
+
+
+def test_lazy_layout_only_lays_out_the_first_screen():
+    tokens = FastHtmlLexer(LONG_PAGE).lex()
+    layout = LazyLayout(tokens)
+    assert layout.consumed_tokens < len(tokens) / 10
+    eager = Layout(tokens)
+    assert list(layout) == list(eager)[:len(layout)]
+    assert layout.estimated_height == pytest.approx(eager.estimated_height, rel=0.1)
+
+
+def test_lazy_layout_resumes_to_match_eager_layout():
+    tokens = FastHtmlLexer(LONG_PAGE + "<script>a b</script><big>big</big>").lex()
+    layout = LazyLayout(tokens)
+    layout.ensure(5000)
+    assert layout.ys[-1] > 5000 and not layout.complete
+    layout.ensure(float("inf"))
+    assert layout.complete
+    assert list(layout) == list(Layout(tokens))
+    assert layout.estimated_height == layout.cursor_y
+
+
+def test_scrolling_drives_lazy_layout(monkeypatch):
+    monkeypatch.setattr(HeadlessBrowser, "lazy_layout", True)
+    browser = HeadlessBrowser()
+    browser.load(giraffe.url.URL("data:text/html," + LONG_PAGE))
+    laid_out = len(browser.display_list)
+    for _ in range(200):
+        browser.scroll_down(None)
+    assert len(browser.display_list) > laid_out
+    assert browser.display_list.ys[-1] > browser.scroll + browser.height
+
+
+BATCH = [f"data:text/html,<p>page {i}</p><b>bold</b>" for i in range(20)]
+
+
+def test_render_page():
+    lines = [json.loads(line) for line in render_page("data:text/html,A <b>B</b>").splitlines()]
+    assert lines == [
+        {"url": "data:text/html,A <b>B</b>", "word": "A", "x": 13, "y": 18, "weight": "normal", "slant": "roman", "size": 12},
+        {"url": "data:text/html,A <b>B</b>", "word": "B", "x": 47, "y": 18, "weight": "bold", "slant": "roman", "size": 12},
+    ]
+
+
+def test_render_page_reports_errors(tmp_path):
+    line, = render_page((tmp_path / "missing.html").as_uri()).splitlines()
+    assert json.loads(line)["error"].startswith("FileNotFoundError")
+
+
+def test_render_batch_in_input_order():
+    assert list(render_batch(BATCH, workers=2, chunk_size=3)) == [render_page(url) for url in BATCH]
+
+
+def test_render_batch_in_completion_order():
+    pages = list(render_batch(BATCH, order="completion", workers=2, chunk_size=3))
+    assert sorted(pages) == sorted(render_page(url) for url in BATCH)
+
+
+def test_render_batch_bounds_pages_waiting_for_a_slow_one(monkeypatch):
+    release, rendered, seen = threading.Event(), [], []
+
+    def render_chunk(chunk):
+        if chunk[0][0] == 0:
+            release.wait(5)  # a stalled first page
+            seen.append(len(rendered))
+        rendered.extend(chunk)
+        return chunk
+
+    monkeypatch.setattr(giraffe.batch, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(giraffe.batch, "_render_chunk", render_chunk)
+    monkeypatch.setattr(giraffe.url.URL, "html_lexer", None)  # restored after _init_worker runs in this process
+    urls = [f"page {i}" for i in range(1000)]
+    threading.Timer(0.2, release.set).start()
+    assert list(render_batch(urls, workers=2, chunk_size=1)) == urls
+    assert seen[0] < 2 * 2 * giraffe.batch.TASKS_PER_WORKER
+
+
+def test_encoded_layout_round_trips():
+    layout = Layout(FastHtmlLexer(LONG_PAGE[:5000] + "<big>big</big><br>").lex())
+    decoded = decode_layout(encode_layout(layout), giraffe.browser.FakeFont)
+    assert list(decoded) == list(layout)
+    assert decoded.item_words == layout.item_words
+    layout.reflow(300)
+    decoded.reflow(300)
+    assert list(decoded) == list(layout)
+
+
+def test_layout_cache_keys_by_tokens_fonts_and_width(tmp_path):
+    tokens = FastHtmlLexer(LONG_PAGE[:5000]).lex()
+    cache = LayoutCache(tmp_path)
+    first = cache.layout(tokens, giraffe.browser.FakeFont)
+    assert list(cache.layout(tokens, giraffe.browser.FakeFont)) == list(first)
+    assert cache.lookup(token_digest(tokens), giraffe.browser.FakeFont, 300) is None
+    assert cache.lookup(token_digest(tokens[1:]), giraffe.browser.FakeFont, 800) is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 3)
+    reopened = LayoutCache(tmp_path)
+    assert list(reopened.lookup(token_digest(tokens), giraffe.browser.FakeFont, 800)) == list(first)
+
+
+def test_layout_cache_evicts_least_recently_used():
+    cache = LayoutCache(max_memory=1)
+    cache.store("digest", Layout([Text("hello")]))
+    assert cache.lookup("digest", giraffe.browser.FakeFont, 800) is None
+
+
+@pytest.mark.parametrize("keep", (10, 100, -100))
+def test_layout_cache_replaces_truncated_entries(tmp_path, keep):
+    url = "data:text/html," + LONG_PAGE[:5000]
+    render_page(url, LayoutCache(tmp_path))
+    [path] = tmp_path.glob("*.layout")
+    path.write_bytes(path.read_bytes()[:keep])
+    caches = [LayoutCache(tmp_path) for _ in range(2)]
+    assert [render_page(url, cache) for cache in caches] == [render_page(url)] * 2
+    assert [(cache.stats.hits, cache.stats.misses) for cache in caches] == [(0, 1), (1, 0)]
+
+
+def test_browser_reuses_cached_layouts(monkeypatch):
+    cache = LayoutCache()
+    monkeypatch.setattr(HeadlessBrowser, "layout_cache", cache)
+    url = "data:text/html," + LONG_PAGE[:5000]
+
+    class Event:
+        height = 600
+
+        def __init__(self, width):
+            self.width = width
+    browser = HeadlessBrowser()
+    browser.load(giraffe.url.URL(url))
+    expected = list(browser.display_list)
+    browser.resize(Event(300))
+    browser.resize(Event(800))
+    assert list(browser.display_list) == expected
+    HeadlessBrowser().load(giraffe.url.URL(url))
+    assert (cache.stats.hits, cache.stats.misses) == (2, 2)
+
+
+def test_render_page_with_layout_cache():
+    cache = LayoutCache()
+    url = "data:text/html,A <b>B</b>"
+    assert render_page(url, cache) == render_page(url, cache) == render_page(url)
+    assert cache.stats.hits == 1
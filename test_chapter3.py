@@ -1,15 +1,22 @@
+import logging
+import threading
+import time
 import tkinter
 
 import pytest
 
-from conftest import SCROLL_AMOUNT, ORIGIN
-from giraffe.browser import Browser, Layout, FakeFont
-from giraffe.url import Text, Tag
+from conftest import SCROLL_AMOUNT, ORIGIN, Route
+from giraffe.browser import Browser, Layout, FakeFont, FontCache
+from giraffe.loader import PageLoad
+from giraffe.url import URL, Text, Tag
 
 
-def test_tk_browser(sample_url):
+def test_tk_browser(sample_url, caplog):
+    caplog.set_level(logging.INFO)
     browser = Browser()
     browser.load(sample_url)
+    while browser.page_load:
+        browser.window.update()
 
     ## text_displayed
     assert browser.window.children == {'!canvas': browser.canvas}
@@ -17,6 +24,7 @@ def test_tk_browser(sample_url):
     actual_font_name = browser.canvas.itemcget('bold', 'font')
     actual_font = tkinter.font.Font(name=actual_font_name, exists=True)
     assert actual_font.cget("weight") == "bold"
+    assert "Font cache:" in caplog.text
 
     ## bindings
     assert "scroll_down" in browser.window.bind('<Down>')  # Not ideal but Tkinter is not test-friendly
@@ -55,6 +63,12 @@ def test_end_tag_in_attribute():
     assert len(layout) == 0
 
 
+def test_unknown_tags_are_ignored():
+    layout = Layout([Tag("scripted"), Tag('b class="x"'), Text("bold"), Tag("/bogus")])
+    _, text, font = layout[0]
+    assert (text, font) == ("bold", FakeFont(weight="bold"))
+
+
 @pytest.mark.parametrize("tag,size0,size1", (
         ("big", 16, 20),
         ("small", 10, 8),
@@ -70,3 +84,120 @@ def test_layout_size(tag, size0, size1):
     _, text, font = layout[2]
     assert text == "normal"
     assert font == FakeFont(size=12)
+
+
+def test_font_cache_reuses_fonts_and_widths():
+    fonts = FontCache(FakeFont)
+    key = ("bold", "roman", 12)
+    assert fonts.font(key) is fonts.font(key)
+    assert fonts.font(key) == FakeFont(weight="bold")
+    assert fonts.measure(key, "word") == fonts.measure(key, "word") == 4 * FakeFont.HSTEP
+    assert (fonts.hits, fonts.misses) == (1, 1)
+
+
+def test_font_cache_evicts_least_recently_used_word():
+    fonts = FontCache(FakeFont, max_words=2)
+    key = ("normal", "roman", 12)
+    for word in ("a", "b", "a", "c", "a", "b"):
+        fonts.measure(key, word)
+    assert (fonts.hits, fonts.misses) == (2, 4)
+
+
+class ProportionalFont(FakeFont):
+    @staticmethod
+    def metrics(name):
+        return 0 if name == "fixed" else FakeFont.metrics(name)
+
+    @staticmethod
+    def measure(word):
+        return sum(2 if c.isascii() else 4 * FakeFont.HSTEP for c in word) + 7 * word.count("W")
+
+
+class WideCjkFont(ProportionalFont):
+    @staticmethod
+    def metrics(name):
+        return 1 if name == "fixed" else FakeFont.metrics(name)
+
+
+@pytest.mark.parametrize("fonts", (FakeFont, ProportionalFont, WideCjkFont))
+@pytest.mark.parametrize("width", (800, 120, 20))
+def test_runs_lay_out_like_single_words(fonts, width):
+    text = " ".join(["a", "Wide", "\u4e2d\u6587", "word", "x" * 30] * 40)
+    expected = Layout([], fonts, width)
+    for word in text.split():
+        expected.word(word)
+    actual = Layout([Text(text)], fonts, width)
+    assert list(actual) == list(expected)
+
+
+def test_fixed_width_fast_path_needs_uniform_characters():
+    fixed, wide = FontCache(FakeFont), FontCache(WideCjkFont)
+    key = ("normal", "roman", 12)
+    assert fixed.measure_words(key, ["ab", "\u4e2d"]) == [2 * FakeFont.HSTEP, FakeFont.HSTEP]
+    assert (fixed.hits, fixed.misses) == (0, 0)
+    assert wide.measure_words(key, ["ab", "\u4e2d"]) == [4, 4 * FakeFont.HSTEP]
+    assert wide.misses == 2
+
+
+class MonospaceTkFont(WideCjkFont):
+    uniform_width = False  # what a real font looks like: fixed and passing the probe, but no promise
+
+    @staticmethod
+    def measure(word):
+        return FakeFont.measure(word.replace("\u0301", ""))  # combining accents take no space
+
+
+def test_fixed_width_fast_path_needs_declared_uniform_width():
+    fonts = FontCache(MonospaceTkFont)
+    assert fonts.measure_words(("normal", "roman", 12), ["cafe\u0301"]) == [4 * FakeFont.HSTEP]
+    assert fonts.misses == 1
+
+
+def test_resize_does_not_measure_again(browser):
+    hits, misses = browser.fonts.hits, browser.fonts.misses
+
+    class MockEvent:
+        width, height = 300, 400
+
+    browser.resize(MockEvent())
+    assert (browser.fonts.hits, browser.fonts.misses) == (hits, misses)
+
+
+class FakeWindow:
+    def __init__(self):
+        self.callbacks = []
+
+    def after(self, _, callback):
+        self.callbacks.append(callback)
+
+    def run(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.callbacks and time.monotonic() < deadline:
+            self.callbacks.pop(0)()
+            time.sleep(0.001)
+
+
+def test_page_load_delivers_tokens_on_polling_thread(http_server):
+    http_server.routes["/page"] = Route(b"<p>some words</p>" * 5_000, chunked=True)
+    url = http_server.url("/page")
+    window, received, done = FakeWindow(), [], []
+
+    def on_tokens(tokens):
+        assert threading.current_thread() is threading.main_thread()
+        received.append(tokens)
+    PageLoad(URL(url), window.after, on_tokens, done.append).start()
+    window.run()
+    assert done == [None]
+    assert len(received) > 1
+    assert [token for tokens in received for token in tokens] == URL(url).load()
+
+
+def test_cancelled_page_load_stops_delivering(http_server):
+    http_server.routes["/slow"] = Route(b"<p>slow</p>", delay=0.05)
+    window, received, done = FakeWindow(), [], []
+    load = PageLoad(URL(http_server.url("/slow")), window.after, received.append, done.append)
+    load.start()
+    load.cancel()
+    window.run()
+    load._thread.join()
+    assert received == [] and done == []